@@ -0,0 +1,439 @@
+"""
+Benchmarks for the DJ's hot paths, on a synthetic library and simulated players.
+
+    python bench.py --entries 50000 --tag-depth 6 --history 5000
+    python bench.py --save baseline.json
+    python bench.py --compare baseline.json
+
+With --compare, the exit status is 1 if any benchmark's median got slower
+than the baseline by more than --tolerance.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+import python_vlc_http
+from constants import BASE_TAGS, DJState, FieldIds, TagId
+from dj import AutoMediaDJ
+from fake_vlc import FakeVLCServer, InProcessVLC, SimulatedVLC, VirtualClock
+from library import Library
+from models import PlaybackInfo
+from vlc_ext import HttpVLCExt
+import utils
+
+# Tags that custom tag chains end in, so that deep chains affect classification
+CHAIN_TARGETS = [
+    TagId.MUSIC,
+    TagId.HAS_MUSIC,
+    TagId.NEEDS_VISUALS,
+    TagId.HAS_OPTIONAL_VISUALS,
+    TagId.SILENT_VIDEO,
+    TagId.AUDIOVISUAL_VIDEO,
+    TagId.ARCHIVED,
+]
+
+CHECKBOX_FIELDS = [
+    FieldIds.ARCHIVED,
+    FieldIds.HAS_MUSIC,
+    FieldIds.NEEDS_VISUALS,
+    FieldIds.OPTIONAL_VISUALS,
+]
+
+
+def generate_library(
+    base_path: str,
+    entries: int,
+    tag_depth: int = 4,
+    tag_chains: int = 8,
+    seed: int = 0,
+) -> str:
+    """
+    Write a synthetic ts_library.json under base_path and return its path.
+
+    On top of the base tags there are tag_chains chains of tag_depth custom
+    tags, each tag having the next one as a subtag, and the last one a base
+    tag the DJ classifies by.
+    """
+    rng = random.Random(seed)
+    tags = [dict(tag) for tag in BASE_TAGS]
+
+    next_tag_id = 10000
+    for chain in range(tag_chains):
+        target = int(CHAIN_TARGETS[chain % len(CHAIN_TARGETS)])
+        chain_ids = list(range(next_tag_id, next_tag_id + tag_depth))
+        next_tag_id += tag_depth
+
+        for depth, tag_id in enumerate(chain_ids):
+            subtag_id = chain_ids[depth + 1] if depth + 1 < tag_depth else target
+            tags.append(
+                {
+                    "id": tag_id,
+                    "name": f"Chain {chain} depth {depth}",
+                    "subtag_ids": [subtag_id],
+                }
+            )
+
+    tag_ids = [tag["id"] for tag in tags]
+
+    entry_dicts = []
+    for entry_id in range(entries):
+        fields: List[Dict[str, Any]] = []
+        if rng.random() < 0.8:
+            fields.append(
+                {
+                    str(int(FieldIds.CONTENT_TAGS)): rng.sample(
+                        tag_ids, rng.randint(0, 4)
+                    )
+                }
+            )
+
+        if rng.random() < 0.3:
+            fields.append(
+                {str(int(FieldIds.META_TAGS)): rng.sample(tag_ids, rng.randint(0, 2))}
+            )
+
+        for field_id in CHECKBOX_FIELDS:
+            if rng.random() < 0.1:
+                fields.append({str(int(field_id)): rng.random() < 0.7})
+
+        entry_dicts.append(
+            {
+                "id": entry_id,
+                "filename": f"media_{entry_id}.mp4",
+                "path": f"folder_{entry_id % 97}",
+                "fields": fields,
+            }
+        )
+
+    tagstudio_dir = os.path.join(base_path, ".TagStudio")
+    os.makedirs(tagstudio_dir, exist_ok=True)
+    tagstudio_file = os.path.join(tagstudio_dir, "ts_library.json")
+
+    with open(tagstudio_file, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "ts-version": "9.2.0",
+                "ext_list": [],
+                "is_exclude_list": True,
+                "tags": tags,
+                "collations": [],
+                "fields": [],
+                "macros": [],
+                "entries": entry_dicts,
+            },
+            file,
+        )
+
+    return tagstudio_file
+
+
+def percentile(sorted_samples: List[float], fraction: float) -> float:
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+def summarize(samples_ns: List[int]) -> Dict[str, float]:
+    samples = sorted(sample / 1000 for sample in samples_ns)
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "mean_us": total / len(samples),
+        "p50_us": percentile(samples, 0.50),
+        "p90_us": percentile(samples, 0.90),
+        "p99_us": percentile(samples, 0.99),
+        "max_us": samples[-1],
+        "ops_per_sec": len(samples) / (total / 1e6) if total else float("inf"),
+    }
+
+
+def timed(func: Callable[[], Any], iterations: int) -> List[int]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - start)
+
+    return samples
+
+
+def make_simulators(
+    clock: VirtualClock, seed: int
+) -> Tuple[SimulatedVLC, SimulatedVLC]:
+    rng = random.Random(seed)
+
+    def track_length(mrl: str) -> float:
+        return rng.uniform(30, 300)
+
+    return SimulatedVLC(clock, track_length), SimulatedVLC(clock, track_length)
+
+
+def make_dj(
+    base_path: str, history: int, vlc: HttpVLCExt, vlc_audio: HttpVLCExt, seed: int
+) -> AutoMediaDJ:
+    rng = random.Random(seed)
+    dj = AutoMediaDJ(
+        vlc=vlc,
+        vlc_audio=vlc_audio,
+        base_path=base_path,
+        use_library_snapshot=False,
+        persist_history=False,
+    )
+
+    # A week's worth of plays spread over the library
+    now = time.time()
+    visual_choices = dj.visual_choices
+    music_choices = dj.music_choices
+    for _ in range(history):
+        played_at = now - rng.uniform(0, 7 * 24 * 60 * 60)
+
+        if visual_choices:
+            info = PlaybackInfo(
+                entry=rng.choice(visual_choices),
+                base_path=base_path,
+                playback_mode="video",
+                dj_mode=dj.mode,
+                end_time=played_at,
+                is_muted=rng.random() < 0.5,
+            )
+            dj.add_to_video_history(info)
+
+        if music_choices:
+            info = PlaybackInfo(
+                entry=rng.choice(music_choices),
+                base_path=base_path,
+                playback_mode="audio",
+                dj_mode=dj.mode,
+                end_time=played_at,
+            )
+            dj.add_to_audio_history(info)
+
+    return dj
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(args.seed)
+    results: Dict[str, Dict[str, float]] = {}
+
+    with tempfile.TemporaryDirectory() as base_path:
+        tagstudio_file = generate_library(
+            base_path, args.entries, args.tag_depth, args.tag_chains, args.seed
+        )
+
+        results["library_parse"] = summarize(
+            timed(lambda: Library.parse(tagstudio_file), args.repeat)
+        )
+
+        library = Library.parse(tagstudio_file)
+        store = library.store
+        results["library_classify"] = summarize(timed(store.classify, args.repeat))
+
+        rows = [rng.randrange(len(store.ids)) for _ in range(args.iterations)]
+        row_iter = iter(rows)
+
+        def classify_entry():
+            entry = store[next(row_iter)]
+            return (
+                entry.is_archived,
+                entry.is_background_music,
+                entry.is_audiovisual,
+                entry.is_visual,
+            )
+
+        results["entry_flags"] = summarize(timed(classify_entry, args.iterations))
+
+        base_tag_ids = [tag["id"] for tag in BASE_TAGS]
+        targets = [int(tag_id) for tag_id in CHAIN_TARGETS]
+
+        def search_base_tag():
+            return utils.search_for_tag(
+                rng.choice(targets), rng.sample(base_tag_ids, 3)
+            )
+
+        results["search_for_tag"] = summarize(timed(search_base_tag, args.iterations))
+
+        # Roots include the tops of the chains, so some searches go the full depth
+        all_tag_ids = [tag["id"] for tag in library.tags]
+
+        def search_library_tag():
+            return library.tag_index.search(
+                rng.choice(targets), rng.sample(all_tag_ids, 3)
+            )
+
+        results["tag_index_search"] = summarize(
+            timed(search_library_tag, args.iterations)
+        )
+
+        clock = VirtualClock()
+        video, audio = make_simulators(clock, args.seed)
+        dj = make_dj(
+            base_path, args.history, InProcessVLC(video), InProcessVLC(audio), args.seed
+        )
+
+        results["weighted_video_choice"] = summarize(
+            timed(dj.weighted_video_choice, args.iterations)
+        )
+        results["weighted_audio_choice"] = summarize(
+            timed(dj.weighted_audio_choice, args.iterations)
+        )
+
+        dj.set_state(DJState.STARTING)
+
+        def tick():
+            dj.think()
+            clock.advance(args.tick_seconds)
+
+        results["think_tick"] = summarize(timed(tick, args.ticks))
+
+        if args.http:
+            results["think_tick_http"] = bench_http_ticks(base_path, args)
+
+    return results
+
+
+def bench_http_ticks(base_path: str, args: argparse.Namespace) -> Dict[str, float]:
+    """Time DJ ticks against simulated players behind real HTTP servers."""
+    clock = VirtualClock()
+    servers = [
+        FakeVLCServer(
+            simulator,
+            delay=args.delay_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            seed=args.seed,
+        )
+        for simulator in make_simulators(clock, args.seed)
+    ]
+
+    for server in servers:
+        server.start()
+
+    try:
+        dj = make_dj(
+            base_path,
+            args.history,
+            HttpVLCExt(host=servers[0].url),
+            HttpVLCExt(host=servers[1].url),
+            args.seed,
+        )
+
+        # Only fail requests once the DJ is up, as a real player would mid-session
+        for server in servers:
+            server.failure_rate = args.failure_rate
+
+        dj.set_state(DJState.STARTING)
+        errors = 0
+
+        def tick():
+            nonlocal errors
+            try:
+                dj.think()
+            except python_vlc_http.RequestFailed:
+                errors += 1
+            clock.advance(args.tick_seconds)
+
+        summary = summarize(timed(tick, args.ticks))
+        summary["errors"] = errors
+        return summary
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def format_report(results: Dict[str, Dict[str, float]]) -> str:
+    columns = [
+        "count",
+        "mean_us",
+        "p50_us",
+        "p90_us",
+        "p99_us",
+        "max_us",
+        "ops_per_sec",
+    ]
+    lines = [f"{'benchmark':<24}" + "".join(f"{column:>13}" for column in columns)]
+    for name, summary in results.items():
+        if summary.get("errors"):
+            name = f"{name} ({summary['errors']} errors)"
+        lines.append(
+            f"{name:<24}" + "".join(f"{summary[column]:>13.1f}" for column in columns)
+        )
+
+    return "\n".join(lines)
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """Describe every benchmark whose median is slower than the baseline allows."""
+    regressions = []
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = summary["p50_us"] / baseline[name]["p50_us"]
+        if ratio > tolerance:
+            regressions.append(
+                f"{name}: p50 {summary['p50_us']:.1f}us vs "
+                f"{baseline[name]['p50_us']:.1f}us ({ratio:.2f}x)"
+            )
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--tag-depth", type=int, default=4)
+    parser.add_argument("--tag-chains", type=int, default=8)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--tick-seconds", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--http",
+        action="store_true",
+        help="Also time ticks against simulated players over HTTP",
+    )
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    # Track changes would otherwise be logged on every tick
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        if isinstance(logger, logging.Logger):
+            logger.setLevel(logging.WARNING)
+
+    results = run(args)
+    print(format_report(results))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nSlower than the baseline:")
+            print("\n".join(f" - {regression}" for regression in regressions))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
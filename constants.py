@@ -77,6 +77,10 @@ ALL_FIELDS_BY_ID = {
     field["id"]: field for field in itertools.chain(FIELDS, CUSTOM_FIELDS)
 }
 
+CHECKBOX_FIELD_IDS = [
+    field["id"] for field in ALL_FIELDS_BY_ID.values() if field["type"] == "checkbox"
+]
+
 SHARED_FIELDS = [
     FIELDS[FieldIds.TITLE],
     FIELDS[FieldIds.ARTIST],
@@ -118,6 +122,14 @@ class DJState(enum.StrEnum):
     RESUMING = "resuming"
 
 
+class EntryFlag(enum.IntFlag):
+    ARCHIVED = enum.auto()
+    HAS_MUSIC = enum.auto()
+    BACKGROUND_MUSIC = enum.auto()
+    AUDIOVISUAL = enum.auto()
+    VISUAL = enum.auto()
+
+
 class TagColor(enum.StrEnum):
     DEFAULT = ""
     BLACK = "black"
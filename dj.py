@@ -1,123 +1,468 @@
-import json
+import asyncio
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
 from functools import cached_property
 from pydantic import BaseModel, computed_field
 from constants import (
     FIELDS,
     DJMode,
     DJState,
+    EntryFlag,
     PlaybackMode,
 )
 import os
 import itertools
 import random
+import sqlite3
 import utils
 
-from models import Entry, PlaybackInfo, VlcPlayerDataSnapshot
-from utils import windows_path_to_wsl
+from history import HistoryRecord, HistoryStore, PlayHistory
+from library import Library, LibraryDiff, tagstudio_file_path
+from metrics import DJ_STATE, PLANNED_ITEMS, QUEUE_DEPTH, STATE_TRANSITIONS, timed
+from models import Entry, EntryStore, PlaybackInfo, VlcPlayerDataSnapshot
+from planner import LookaheadPlanner
+from prefetch import MediaPrefetcher
+from recency import RecencyModel
+from sampler import WeightedSampler
+from tags import TagIndex
+from utils import indices_from_bitset, windows_path_to_wsl
+from vlc_async import AsyncHttpVLC
 from vlc_ext import HttpVLCExt
 
 logger = utils.get_logger(__name__)
 
 
+def read_library_update(library: Library, tagstudio_file: str) -> Optional[Library]:
+    try:
+        return library.read_update(tagstudio_file)
+    except (OSError, ValueError) as e:
+        # TagStudio might be in the middle of writing the file, so try again later
+        logger.warning(f"Could not reload library: {e}")
+        return None
+
+
+def apply_library_update(
+    library: Library, incoming: Optional[Library], djs: List["AutoMediaDJ"]
+) -> LibraryDiff:
+    if incoming is None:
+        return LibraryDiff()
+
+    # Keep the planners from drawing until the store and samplers match again
+    with library.lock:
+        # The DJs share one store, so the old masks are the same for all of them
+        old_masks = djs[0].choice_masks()
+        diff = library.apply_update(incoming)
+        if not diff.is_empty:
+            for dj in djs:
+                dj.library_reloaded(old_masks)
+
+    if not diff.is_empty:
+        logger.info(f"Library reloaded: {diff}")
+
+    return diff
+
+
+def reload_shared_library(
+    library: Library,
+    tagstudio_file: str,
+    djs: List["AutoMediaDJ"],
+    write_snapshot: bool = True,
+) -> LibraryDiff:
+    """Reload a library the DJs share, if ts_library.json has changed."""
+    incoming = read_library_update(library, tagstudio_file)
+    diff = apply_library_update(library, incoming, djs)
+    if write_snapshot and not diff.is_empty:
+        library.write_snapshot(tagstudio_file)
+
+    return diff
+
+
+async def reload_shared_library_async(
+    library: Library,
+    tagstudio_file: str,
+    djs: List["AutoMediaDJ"],
+    write_snapshot: bool = True,
+) -> LibraryDiff:
+    # The same steps, but reading and saving happen in a worker thread, so the
+    # event loop is only held up while the changes are applied
+    incoming = await asyncio.to_thread(read_library_update, library, tagstudio_file)
+    diff = apply_library_update(library, incoming, djs)
+    if write_snapshot and not diff.is_empty:
+        await asyncio.to_thread(library.write_snapshot, tagstudio_file)
+
+    return diff
+
+
 class AutoMediaDJ(BaseModel):
     vlc: HttpVLCExt
     vlc_audio: Optional[HttpVLCExt] = None
     base_path: str
     mode: DJMode = DJMode.MUSIC_AND_VISUALS
-    play_history: List[PlaybackInfo] = []
-    play_history_audio: List[PlaybackInfo] = []
+    # Set when several DJs run in one process, see zones.py
+    zone: Optional[str] = None
+    shared_library: Optional[Library] = None
+    # Plays kept in memory per player
+    history_size: int = 500
+    # Save the play history in .TagStudio so penalties survive restarts
+    persist_history: bool = True
+    history_loaded: bool = False
+    # Seconds for a play penalty to wear off by half
+    recency_half_life: float = 6 * 60 * 60
     video_queue: List[PlaybackInfo] = []
     audio_queue: List[PlaybackInfo] = []
+    # How many items to keep queued up on each player
+    queue_depth: int = 6
+    # Pairs to keep chosen ahead on a background thread; 0 chooses inline
+    lookahead: int = 0
+    # Bytes to read ahead from the start of each queued file; 0 disables it
+    prefetch_bytes: int = 0
+    prefetch_bytes_per_second: float = 32 << 20
     video_playing: Optional[PlaybackInfo] = None
     audio_playing: Optional[PlaybackInfo] = None
     state: DJState = DJState.STOPPED
+    # Cache the compiled library next to ts_library.json for fast restarts
+    use_library_snapshot: bool = True
+    # Worker processes for indexing a large library without a snapshot; 0 for none
+    index_workers: int = 0
+    # Pick up changes to ts_library.json while playing
+    watch_library: bool = False
+    library_check_interval: float = 5.0
+    library_checked_at: float = 0.0
+    # Poll often around track changes and state transitions, rarely otherwise
+    min_tick_interval: float = 0.1
+    max_tick_interval: float = 5.0
+    track_end_window: float = 2.0
+    # Ticks that have failed in a row, in the async loop
+    failed_ticks: int = 0
 
     # arbitrary types for pydantic
     class Config:
         arbitrary_types_allowed = True
 
-    @computed_field
+    @property
+    def tagstudio_file(self) -> str:
+        return tagstudio_file_path(self.base_path)
+
+    @property
+    def metric_labels(self) -> Dict[str, str]:
+        return {"zone": self.zone} if self.zone else {}
+
+    def set_state(self, state: DJState):
+        labels = self.metric_labels
+        if state != self.state:
+            STATE_TRANSITIONS.inc(from_state=self.state, to_state=state, **labels)
+            DJ_STATE.set(0, state=self.state, **labels)
+
+        DJ_STATE.set(1, state=state, **labels)
+        self.state = state
+
+    def update_gauges(self):
+        labels = self.metric_labels
+        QUEUE_DEPTH.set(len(self.video_queue), player="video", **labels)
+        QUEUE_DEPTH.set(len(self.audio_queue), player="audio", **labels)
+        if self.planner is not None:
+            for mode in (PlaybackMode.VIDEO, PlaybackMode.AUDIO):
+                PLANNED_ITEMS.set(self.planner.planned(mode), player=mode, **labels)
+
+    @cached_property
+    def history_store(self) -> Optional[HistoryStore]:
+        if not self.persist_history:
+            return None
+
+        # Zones sharing a library each keep their own history
+        name = "dj_history" if self.zone is None else f"dj_history_{self.zone}"
+        history_file = os.path.join(
+            os.path.dirname(self.tagstudio_file), f"{name}.sqlite3"
+        )
+        try:
+            return HistoryStore(history_file)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open play history {history_file}: {e}")
+            return None
+
     @cached_property
-    def tagstudio_data(self) -> Dict[str, Any]:
-        tagstudio_file = os.path.join(self.base_path, ".TagStudio", "ts_library.json")
-        tagstudio_file = windows_path_to_wsl(tagstudio_file)
+    def play_history(self) -> PlayHistory:
+        return PlayHistory(PlaybackMode.VIDEO, self.history_size, self.history_store)
 
-        with open(tagstudio_file, "r") as file:
-            return json.load(file)
+    @cached_property
+    def play_history_audio(self) -> PlayHistory:
+        return PlayHistory(PlaybackMode.AUDIO, self.history_size, self.history_store)
+
+    def load_history(self):
+        """Restore the histories and weights left by previous runs, once."""
+        if self.history_loaded:
+            return
+
+        self.history_loaded = True
+        store = self.history_store
+        if store is None:
+            return
+
+        try:
+            self.play_history.load()
+            self.play_history_audio.load()
+
+            # Plays older than the horizon have worn off anyway
+            now = time.time()
+            since = now - self.video_recency.horizon
+            for record in store.plays_between(PlaybackMode.VIDEO, since, now):
+                self.video_recency.add_play(
+                    record.entry_id,
+                    self.played_at(record),
+                    self.video_penalty(record.is_muted),
+                )
+
+            since = now - self.audio_recency.horizon
+            for record in store.plays_between(PlaybackMode.AUDIO, since, now):
+                self.audio_recency.add_play(
+                    record.entry_id, self.played_at(record), self.audio_penalty()
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not load play history: {e}")
+            return
+
+        logger.info(
+            f"Loaded play history: {len(self.play_history)} videos, "
+            f"{len(self.play_history_audio)} audio"
+        )
+
+    @cached_property
+    def video_recency(self) -> RecencyModel:
+        return RecencyModel(self.recency_half_life)
+
+    @cached_property
+    def audio_recency(self) -> RecencyModel:
+        return RecencyModel(self.recency_half_life)
+
+    @cached_property
+    def library(self) -> Library:
+        if self.shared_library is not None:
+            return self.shared_library
+
+        return Library.load(
+            self.tagstudio_file, self.use_library_snapshot, self.index_workers
+        )
+
+    @property
+    def tag_index(self) -> TagIndex:
+        return self.library.tag_index
+
+    @property
+    def entry_store(self) -> EntryStore:
+        return self.library.store
 
     @computed_field
     @cached_property
     def entries(self) -> List[Entry]:
-        return [Entry(entry_dict=entry) for entry in self.tagstudio_data["entries"]]
+        return list(self.entry_store)
 
     @computed_field
     @cached_property
     def media_choices(self) -> List[Entry]:
-        return [entry for entry in self.entries if not entry.is_archived]
+        return self.entry_store.select(exclude=EntryFlag.ARCHIVED)
 
     @computed_field
     @cached_property
     def tag_lookup_by_id(self) -> Dict[int, Any]:
-        return {tag["id"]: tag for tag in self.tagstudio_data["tags"]}
+        return {tag["id"]: tag for tag in self.library.tags}
 
     @computed_field
     @cached_property
     def field_lookup_by_id(self) -> Dict[int, Any]:
         return {
-            field["id"]: field
-            for field in itertools.chain(FIELDS, self.tagstudio_data["fields"])
+            field["id"]: field for field in itertools.chain(FIELDS, self.library.fields)
         }
 
     @computed_field
     @cached_property
     def music_choices(self) -> List[Entry]:
-        return [entry for entry in self.media_choices if entry.is_background_music]
+        return self.entry_store.select(
+            include=EntryFlag.BACKGROUND_MUSIC, exclude=EntryFlag.ARCHIVED
+        )
 
     @computed_field
     @cached_property
     def audiovisual_choices(self) -> List[Entry]:
-        return [entry for entry in self.media_choices if entry.is_audiovisual]
+        return self.entry_store.select(
+            include=EntryFlag.AUDIOVISUAL, exclude=EntryFlag.ARCHIVED
+        )
 
     @computed_field
     @cached_property
     def visual_choices(self) -> List[Entry]:
-        return [entry for entry in self.media_choices if entry.is_visual]
+        return self.entry_store.select(
+            include=EntryFlag.VISUAL, exclude=EntryFlag.ARCHIVED
+        )
+
+    @cached_property
+    def video_sampler(self) -> WeightedSampler:
+        self.load_history()
+        # Recency is applied at draw time, so the base weights stay uniform
+        return WeightedSampler(entry.id for entry in self.visual_choices)
 
-    def queue_video(self, video_info: PlaybackInfo):
-        if video_info.playback_mode == PlaybackMode.AUDIO:
-            raise ValueError("Cannot queue audio with this method")
+    @cached_property
+    def audio_sampler(self) -> WeightedSampler:
+        self.load_history()
+        return WeightedSampler(entry.id for entry in self.music_choices)
 
-        logger.debug(f"Queueing video: {video_info}")
+    @cached_property
+    def planner(self) -> Optional[LookaheadPlanner]:
+        if self.lookahead <= 0:
+            return None
+
+        return LookaheadPlanner(
+            {
+                PlaybackMode.VIDEO: self.choose_video,
+                PlaybackMode.AUDIO: self.choose_audio,
+            },
+            self.lookahead,
+            lock=self.library.lock,
+        )
 
-        mrl_list = video_info.get_mrls()
+    @cached_property
+    def prefetcher(self) -> Optional[MediaPrefetcher]:
+        if self.prefetch_bytes <= 0:
+            return None
 
-        for mrl in mrl_list:
-            self.vlc.enqueue(mrl)
+        return MediaPrefetcher(self.prefetch_bytes, self.prefetch_bytes_per_second)
 
-        self.video_queue.append(video_info)
+    def prefetch(self, info: PlaybackInfo):
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(windows_path_to_wsl(info.file_path))
 
-    def queue_audio(self, audio_info: PlaybackInfo):
-        if audio_info.playback_mode != PlaybackMode.AUDIO:
-            raise ValueError("Can only queue audio with this method")
+    @cached_property
+    def async_vlc(self) -> AsyncHttpVLC:
+        return AsyncHttpVLC(self.vlc)
 
-        logger.debug(f"Queueing audio: {audio_info}")
+    @cached_property
+    def async_vlc_audio(self) -> AsyncHttpVLC:
+        return AsyncHttpVLC(self.vlc_audio)
 
-        mrl_list = audio_info.get_mrls()
+    def library_check_due(self) -> bool:
+        if not self.watch_library:
+            return False
 
-        for mrl in mrl_list:
-            self.vlc_audio.enqueue(mrl)
+        now = time.time()
+        if now - self.library_checked_at < self.library_check_interval:
+            return False
+
+        self.library_checked_at = now
+        return True
 
+    def check_library(self):
+        if self.library_check_due():
+            self.reload_library()
+
+    async def check_library_async(self):
+        if self.library_check_due():
+            await reload_shared_library_async(
+                self.library, self.tagstudio_file, [self], self.use_library_snapshot
+            )
+
+    def reload_library(self) -> LibraryDiff:
+        return reload_shared_library(
+            self.library, self.tagstudio_file, [self], self.use_library_snapshot
+        )
+
+    def choice_masks(self) -> Tuple[int, int]:
+        """Rows of the visual and music choices, to compare across a reload."""
+        store = self.entry_store
+        return (
+            store.select_mask(include=EntryFlag.VISUAL, exclude=EntryFlag.ARCHIVED),
+            store.select_mask(
+                include=EntryFlag.BACKGROUND_MUSIC, exclude=EntryFlag.ARCHIVED
+            ),
+        )
+
+    def library_reloaded(self, old_masks: Tuple[int, int]):
+        """Bring everything derived from the library up to date after a reload."""
+        old_visual_mask, old_music_mask = old_masks
+        new_visual_mask, new_music_mask = self.choice_masks()
+
+        if "video_sampler" in self.__dict__:
+            self.patch_sampler(self.video_sampler, old_visual_mask, new_visual_mask)
+
+        if "audio_sampler" in self.__dict__:
+            self.patch_sampler(self.audio_sampler, old_music_mask, new_music_mask)
+
+        # The choice lists are rebuilt from the new masks the next time they're used
+        for name in (
+            "entries",
+            "media_choices",
+            "tag_lookup_by_id",
+            "field_lookup_by_id",
+            "music_choices",
+            "audiovisual_choices",
+            "visual_choices",
+        ):
+            self.__dict__.pop(name, None)
+
+        # Anything planned so far may have come from entries that are gone
+        if self.__dict__.get("planner") is not None:
+            self.planner.clear()
+
+    def patch_sampler(
+        self,
+        sampler: WeightedSampler,
+        old_mask: int,
+        new_mask: int,
+    ):
+        # Rows only ever leave or join a pool; a changed entry does both
+        for row in indices_from_bitset(old_mask & ~new_mask):
+            sampler.set_weight(self.entry_store.ids[row], 0.0)
+
+        for row in indices_from_bitset(new_mask & ~old_mask):
+            sampler.add(self.entry_store.ids[row])
+
+    def video_queued(self, video_info: PlaybackInfo):
+        logger.debug(f"Queued video: {video_info}")
+        self.video_queue.append(video_info)
+        self.prefetch(video_info)
+
+    def audio_queued(self, audio_info: PlaybackInfo):
+        logger.debug(f"Queued audio: {audio_info}")
         self.audio_queue.append(audio_info)
+        self.prefetch(audio_info)
 
         # TODO: This shouldn't happen until the video is actually playing
         # Add the audio playback info to the play history
         audio_info.index = len(self.play_history_audio)
         audio_info.start_time = time.time()
-        self.play_history_audio.append(audio_info)
-
-    def update_playback_info(self):
+        self.add_to_audio_history(audio_info)
+
+    def video_penalty(self, is_muted: bool) -> float:
+        if is_muted:
+            # Reduce the penalty if previously played muted
+            return 0.8
+
+        # Apply a penalty if recently played unmuted
+        return 0.5
+
+    def audio_penalty(self) -> float:
+        return 0.5
+
+    def played_at(self, record: HistoryRecord) -> float:
+        played_at = record.played_at
+        return played_at if played_at is not None else time.time()
+
+    def add_to_video_history(self, video_info: PlaybackInfo):
+        record = HistoryRecord.from_playback_info(video_info)
+        self.play_history.append(record)
+        self.video_recency.add_play(
+            record.entry_id,
+            self.played_at(record),
+            self.video_penalty(record.is_muted),
+        )
+
+    def add_to_audio_history(self, audio_info: PlaybackInfo):
+        record = HistoryRecord.from_playback_info(audio_info)
+        self.play_history_audio.append(record)
+        self.audio_recency.add_play(
+            record.entry_id, self.played_at(record), self.audio_penalty()
+        )
+
+    @timed("update_playback_info")
+    def update_playback_info(self, prefetched: bool = False):
         if self.vlc.enabled and len(self.video_queue) < 2:
             # Wait for more videos to be queued before starting playback
             logger.debug(f"Waiting for more videos to be queued...")
@@ -131,11 +476,18 @@ class AutoMediaDJ(BaseModel):
         video_player_data: Optional[VlcPlayerDataSnapshot] = None
         audio_player_data: Optional[VlcPlayerDataSnapshot] = None
 
+        # The async loop polls both players up front, concurrently
         if self.vlc.enabled:
-            video_player_data = self.vlc.fetch_data_snapshot()
+            if prefetched:
+                video_player_data = self.vlc.recent_data
+            else:
+                video_player_data = self.vlc.fetch_data_snapshot()
 
         if self.vlc_audio.enabled:
-            audio_player_data = self.vlc_audio.fetch_data_snapshot()
+            if prefetched:
+                audio_player_data = self.vlc_audio.recent_data
+            else:
+                audio_player_data = self.vlc_audio.fetch_data_snapshot()
 
         timestamp = time.time()
 
@@ -151,8 +503,8 @@ class AutoMediaDJ(BaseModel):
                         f" - end_time: {self.video_playing.end_time} => {timestamp} (delta {timestamp - self.video_playing.end_time})\n"
                     )
 
-                    self.play_history.append(self.video_playing)
                     self.video_playing.end_time = timestamp
+                    self.add_to_video_history(self.video_playing)
                     self.video_playing = None
 
                 # If video_playing is None, we need to consume the queue and update the current playback info
@@ -178,8 +530,8 @@ class AutoMediaDJ(BaseModel):
                         f" - end_time: {self.audio_playing.end_time} => {timestamp} (delta {timestamp - self.audio_playing.end_time})\n"
                     )
 
-                    self.play_history_audio.append(self.audio_playing)
                     self.audio_playing.end_time = timestamp
+                    self.add_to_audio_history(self.audio_playing)
                     self.audio_playing = None
 
                 # If audio_playing is None, we need to consume the queue and update the current playback info
@@ -196,17 +548,21 @@ class AutoMediaDJ(BaseModel):
 
         return True
 
-    def update_players(self):
+    def enable_players(self):
         if self.mode == DJMode.MUSIC_AND_VISUALS:
             self.vlc.enabled = True
             self.vlc_audio.enabled = True
 
+    @timed("update_players")
+    def update_players(self, prefetched: bool = False):
+        self.enable_players()
+
         if self.state == DJState.STOPPED:
             return
 
         is_playing = True
         is_paused = True
-        is_ready = self.update_playback_info()
+        is_ready = self.update_playback_info(prefetched)
 
         vid_info = self.video_playing or next(iter(self.video_queue), None)
         aud_info = self.audio_playing or next(iter(self.audio_queue), None)
@@ -239,7 +595,7 @@ class AutoMediaDJ(BaseModel):
                 logger.info(
                     "All players are playing\n - updating DJState: STARTING => PLAYING"
                 )
-                self.state = DJState.PLAYING
+                self.set_state(DJState.PLAYING)
                 return
 
             if not vid_info and video_player_data.volume == 0:
@@ -269,7 +625,7 @@ class AutoMediaDJ(BaseModel):
                 logger.info(
                     "All players have paused\n - updating DJState: PLAYING => PAUSED"
                 )
-                self.state = DJState.PAUSED
+                self.set_state(DJState.PAUSED)
                 return
 
             # If any active player is not playing anymore, initiate a pause
@@ -278,7 +634,7 @@ class AutoMediaDJ(BaseModel):
                 "Some players are not playing, initiate pause\n"
                 " - updating DJState: PLAYING => PAUSING"
             )
-            self.state = DJState.PAUSING
+            self.set_state(DJState.PAUSING)
 
         # A pause has been initiated
         if self.state == DJState.PAUSING:
@@ -287,7 +643,7 @@ class AutoMediaDJ(BaseModel):
                 logger.info(
                     "All players have paused\n - updating DJState: PAUSING => PAUSED"
                 )
-                self.state = DJState.PAUSED
+                self.set_state(DJState.PAUSED)
                 return
 
             # If any active player is still playing, continue pausing
@@ -308,7 +664,7 @@ class AutoMediaDJ(BaseModel):
                 "Some players are not paused, initiate resume\n"
                 " - updating DJState: PAUSED => RESUMING"
             )
-            self.state = DJState.RESUMING
+            self.set_state(DJState.RESUMING)
 
         # A resume has been initiated
         if self.state == DJState.RESUMING:
@@ -317,7 +673,7 @@ class AutoMediaDJ(BaseModel):
                 logger.info(
                     "All players have resumed\n - updating DJState: RESUMING => PLAYING"
                 )
-                self.state = DJState.PLAYING
+                self.set_state(DJState.PLAYING)
                 return
 
             # If any active player is still paused, continue resuming
@@ -330,87 +686,296 @@ class AutoMediaDJ(BaseModel):
     def start(self):
         # Start the DJ loop
         logger.info("Starting DJ loop...")
-        self.state = DJState.STARTING
+        self.set_state(DJState.STARTING)
         while True:
+            tick_start = time.monotonic()
             self.think()
-            time.sleep(0.5)
+            time.sleep(
+                max(0.0, self.next_tick_delay() - (time.monotonic() - tick_start))
+            )
 
-    def think(self):
-        self.update_players()
+    def next_tick_delay(self) -> float:
+        """Seconds until the next moment worth polling the players for."""
+        if self.failed_ticks:
+            # The players are unreachable, so back off until they're back
+            return min(
+                self.min_tick_interval * 2**self.failed_ticks, self.max_tick_interval
+            )
 
-        if self.mode == DJMode.MUSIC_AND_VISUALS:
-            if len(self.video_queue) > 5 and len(self.audio_queue) > 5:
-                # No need to queue so many videos and audio
-                return
+        if self.state in (DJState.STARTING, DJState.PAUSING, DJState.RESUMING):
+            # Transitions need quick confirmation from the players
+            return self.min_tick_interval
 
-            # Randomly choose a visual with weighted probability based on play history
-            visual_choice = self.weighted_video_choice(self.visual_choices)
+        if self.state != DJState.PLAYING:
+            # Paused or stopped: only need to notice the players being resumed
+            return self.max_tick_interval
 
-            # Create a PlaybackInfo object for the visual choice
-            visual_playback_info = PlaybackInfo(
-                entry=visual_choice,
-                base_path=self.base_path,
-                playback_mode=PlaybackMode.VIDEO,
-                dj_mode=self.mode,
-                is_muted=True,  # Mute the visual
-            )
+        if (self.vlc.enabled and len(self.video_queue) < 2) or (
+            self.vlc_audio.enabled and len(self.audio_queue) < 2
+        ):
+            # Still filling the queues
+            return self.min_tick_interval
+
+        remaining_times = []
+        for player in (self.vlc, self.vlc_audio):
+            player_data = player.recent_data
+            if player_data is None:
+                continue
+
+            if player_data.length is None or player_data.time is None:
+                return self.min_tick_interval
+
+            remaining_times.append(player_data.length - player_data.time)
+
+        if not remaining_times:
+            return self.max_tick_interval
+
+        # VLC reports whole seconds, so start polling tightly a bit before the end
+        until_window = min(remaining_times) - self.track_end_window
+        if until_window <= 0:
+            return self.min_tick_interval
 
-            # Randomly choose a music track with weighted probability based on play history
-            music_choice = self.weighted_audio_choice(self.music_choices)
+        return min(max(until_window, self.min_tick_interval), self.max_tick_interval)
 
-            # Create a PlaybackInfo object for the music choice
-            music_playback_info = PlaybackInfo(
-                entry=music_choice,
-                base_path=self.base_path,
-                playback_mode=PlaybackMode.AUDIO,
-                dj_mode=self.mode,
+    @timed("think")
+    def think(self):
+        self.check_library()
+        self.update_players()
+
+        videos, audios = self.plan_batch()
+
+        try:
+            if videos:
+                self.queue_videos(videos)
+
+            if audios:
+                self.queue_audios(audios)
+        finally:
+            self.update_gauges()
+
+    async def start_async(
+        self,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        on_recovered: Optional[Callable[[], None]] = None,
+    ):
+        # Start the DJ loop on the running event loop. With on_error, failed ticks
+        # are retried with a growing delay, in the same state. on_error hears about
+        # the first failure in a row and on_recovered about the tick that ends it
+        logger.info("Starting async DJ loop...")
+        self.set_state(DJState.STARTING)
+        while True:
+            tick_start = time.monotonic()
+            try:
+                await self.think_async()
+            except Exception as e:
+                if on_error is None:
+                    raise
+
+                self.failed_ticks += 1
+                if self.failed_ticks == 1:
+                    on_error(e)
+                else:
+                    logger.debug(f"Tick failed {self.failed_ticks} times in a row: {e}")
+            else:
+                if self.failed_ticks:
+                    self.failed_ticks = 0
+                    if on_recovered is not None:
+                        on_recovered()
+
+            # Sleep until the next interesting moment, minus the time the tick took
+            await asyncio.sleep(
+                max(0.0, self.next_tick_delay() - (time.monotonic() - tick_start))
             )
 
-            self.queue_video(visual_playback_info)
-            self.queue_audio(music_playback_info)
-            return
+    @timed("think")
+    async def think_async(self):
+        await self.check_library_async()
+        self.enable_players()
+
+        # Poll both players at once, so a tick costs one round trip instead of two
+        polls = [
+            player.fetch_data_snapshot()
+            for player in (self.async_vlc, self.async_vlc_audio)
+            if player.enabled
+        ]
+        await asyncio.gather(*polls)
+
+        # The state machine only sends commands on transitions, so it can run as-is
+        # in a worker thread
+        await asyncio.to_thread(self.update_players, True)
+
+        videos, audios = self.plan_batch()
+
+        enqueues = []
+        if videos:
+            enqueues.append(self.queue_videos_async(videos))
+
+        if audios:
+            enqueues.append(self.queue_audios_async(audios))
+
+        # Let both finish, so whatever one player accepted is still tracked
+        results = await asyncio.gather(*enqueues, return_exceptions=True)
+        self.update_gauges()
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    @timed("plan_batch")
+    def plan_batch(self) -> Tuple[List[PlaybackInfo], List[PlaybackInfo]]:
+        # Choose enough to fill each queue back up to queue_depth. Nothing is
+        # tracked until the players have accepted it, see queue_batch
+        video_count = self.queue_depth - len(self.video_queue)
+        audio_count = self.queue_depth - len(self.audio_queue)
+
+        if self.mode != DJMode.MUSIC_AND_VISUALS or max(video_count, audio_count) <= 0:
+            return [], []
+
+        if self.planner is not None:
+            # Build the samplers here first, so the planner thread doesn't race us to it
+            self.video_sampler, self.audio_sampler
+            self.planner.start()
+
+        videos = self.plan_items(PlaybackMode.VIDEO, video_count, self.choose_video)
+        audios = self.plan_items(PlaybackMode.AUDIO, audio_count, self.choose_audio)
+        return videos, audios
+
+    def plan_items(
+        self,
+        playback_mode: PlaybackMode,
+        count: int,
+        choose: Callable[[Collection[int]], PlaybackInfo],
+    ) -> List[PlaybackInfo]:
+        if count <= 0:
+            return []
+
+        items = []
+        if self.planner is not None:
+            items = self.planner.take(playback_mode, count)
+
+        while len(items) < count:
+            # Don't pick the same thing twice in one batch
+            items.append(choose({item.entry.id for item in items}))
+
+        return items
+
+    def enqueue_batches(
+        self, vlc: HttpVLCExt, infos: List[PlaybackInfo]
+    ) -> List[List[PlaybackInfo]]:
+        # One request if VLC can read a playlist file, otherwise one per item, so
+        # a failure part way through only loses what VLC never got
+        if vlc.playlist_dir is not None:
+            return [infos]
+
+        return [[info] for info in infos]
+
+    def queue_batch(
+        self,
+        vlc: HttpVLCExt,
+        infos: List[PlaybackInfo],
+        queued: Callable[[PlaybackInfo], None],
+    ):
+        for batch in self.enqueue_batches(vlc, infos):
+            vlc.enqueue_many(self.batch_mrls(batch))
+            for info in batch:
+                queued(info)
+
+    async def queue_batch_async(
+        self,
+        vlc: AsyncHttpVLC,
+        infos: List[PlaybackInfo],
+        queued: Callable[[PlaybackInfo], None],
+    ):
+        for batch in self.enqueue_batches(vlc.vlc, infos):
+            await vlc.enqueue_many(self.batch_mrls(batch))
+            for info in batch:
+                queued(info)
+
+    @timed("queue_videos")
+    def queue_videos(self, videos: List[PlaybackInfo]):
+        self.queue_batch(self.vlc, videos, self.video_queued)
+
+    @timed("queue_audios")
+    def queue_audios(self, audios: List[PlaybackInfo]):
+        self.queue_batch(self.vlc_audio, audios, self.audio_queued)
+
+    @timed("queue_videos")
+    async def queue_videos_async(self, videos: List[PlaybackInfo]):
+        await self.queue_batch_async(self.async_vlc, videos, self.video_queued)
+
+    @timed("queue_audios")
+    async def queue_audios_async(self, audios: List[PlaybackInfo]):
+        await self.queue_batch_async(self.async_vlc_audio, audios, self.audio_queued)
+
+    def batch_mrls(self, infos: List[PlaybackInfo]) -> List[str]:
+        return [mrl for info in infos for mrl in info.get_mrls()]
+
+    def choose_video(self, avoid: Collection[int] = ()) -> PlaybackInfo:
+        # Randomly choose a visual with weighted probability based on play history
+        return PlaybackInfo(
+            entry=self.weighted_video_choice(avoid=avoid),
+            base_path=self.base_path,
+            playback_mode=PlaybackMode.VIDEO,
+            dj_mode=self.mode,
+            is_muted=True,  # Mute the visual
+        )
+
+    def choose_audio(self, avoid: Collection[int] = ()) -> PlaybackInfo:
+        # Randomly choose a music track with weighted probability based on play history
+        return PlaybackInfo(
+            entry=self.weighted_audio_choice(avoid=avoid),
+            base_path=self.base_path,
+            playback_mode=PlaybackMode.AUDIO,
+            dj_mode=self.mode,
+        )
+
+    def recency_choice(
+        self,
+        sampler: WeightedSampler,
+        recency: RecencyModel,
+        avoid: Collection[int] = (),
+    ) -> Entry:
+        now = time.time()
+        try:
+            entry_id = sampler.sample_where(
+                lambda entry_id: (
+                    0.0 if entry_id in avoid else recency.weight(entry_id, now)
+                )
+            )
+        except IndexError:
+            if not avoid:
+                raise
+
+            # Fewer choices than items to queue, so a repeat can't be helped
+            entry_id = sampler.sample_where(
+                lambda entry_id: recency.weight(entry_id, now)
+            )
 
-    def weighted_video_choice(self, choices):
-        # Calculate weights based on play history
-        weights = []
-        for choice in choices:
-            weight = 1.0  # Default weight
-
-            # Check if the choice has been played before
-            for playback_info in self.play_history:
-                if playback_info.entry == choice:
-                    if playback_info.is_muted:
-                        # Reduce the penalty if previously played muted
-                        weight *= 0.8
-                    else:
-                        # Apply a penalty if recently played unmuted
-                        weight *= 0.5
-
-            weights.append(weight)
-
-        # Normalize the weights
-        total_weight = sum(weights)
-        probabilities = [weight / total_weight for weight in weights]
-
-        # Make a weighted random choice
-        return random.choices(choices, probabilities)[0]
-
-    def weighted_audio_choice(self, choices):
-        # Calculate weights based on play history
-        weights = []
-        for choice in choices:
-            weight = 1.0  # Default weight
-
-            # Check if the choice has been played before
-            for playback_info in self.play_history_audio:
-                if playback_info.entry == choice:
-                    weight *= 0.5
-
-            weights.append(weight)
-
-        # Normalize the weights
-        total_weight = sum(weights)
-        probabilities = [weight / total_weight for weight in weights]
-
-        # Make a weighted random choice
-        return random.choices(choices, probabilities)[0]
+        return self.entry_store.entry(entry_id)
+
+    @timed("weighted_video_choice")
+    def weighted_video_choice(
+        self,
+        choices: Optional[List[Entry]] = None,
+        avoid: Collection[int] = (),
+    ) -> Entry:
+        if choices is None:
+            # Draw from all visual choices, weighted by how recently they played
+            return self.recency_choice(self.video_sampler, self.video_recency, avoid)
+
+        now = time.time()
+        weights = [self.video_recency.weight(choice.id, now) for choice in choices]
+        return random.choices(choices, weights)[0]
+
+    @timed("weighted_audio_choice")
+    def weighted_audio_choice(
+        self,
+        choices: Optional[List[Entry]] = None,
+        avoid: Collection[int] = (),
+    ) -> Entry:
+        if choices is None:
+            # Draw from all music choices, weighted by how recently they played
+            return self.recency_choice(self.audio_sampler, self.audio_recency, avoid)
+
+        now = time.time()
+        weights = [self.audio_recency.weight(choice.id, now) for choice in choices]
+        return random.choices(choices, weights)[0]
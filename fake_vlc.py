@@ -0,0 +1,466 @@
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from vlc_ext import HttpVLCExt
+from utils import windows_path_to_wsl
+
+
+class VirtualClock:
+    """A clock that only moves when told to, for repeatable runs."""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class ScaledClock:
+    """Real time, sped up by `speed`, so long tracks finish in a short test."""
+
+    def __init__(self, speed: float = 1.0, start: float = 0.0):
+        self.speed = speed
+        self.start = start
+        self._origin = time.monotonic()
+
+    def __call__(self) -> float:
+        return self.start + (time.monotonic() - self._origin) * self.speed
+
+
+def filename_from_mrl(mrl: str) -> str:
+    path = urllib.parse.urlparse(mrl).path if "://" in mrl else mrl
+    return urllib.parse.unquote(path).replace("\\", "/").rsplit("/", 1)[-1]
+
+
+def filename_path(mrl: str) -> str:
+    """The local path of a file:// MRL."""
+    if not mrl.startswith("file://"):
+        return mrl
+
+    path = urllib.parse.unquote(mrl[len("file://") :])
+    # file:///C:/... is a Windows path
+    if len(path) > 2 and path[0] == "/" and path[2] == ":":
+        return path[1:]
+
+    return path
+
+
+class SimulatedVLC:
+    """
+    Just enough of a VLC player for the commands the DJ sends.
+
+    Playback time comes from `clock`, so items play through and the playlist
+    advances on its own, the way it would in VLC. status() returns a dict
+    shaped like VLC's /requests/status.json.
+    """
+
+    def __init__(
+        self,
+        clock: Optional[Callable[[], float]] = None,
+        track_length: Callable[[str], float] = lambda mrl: 180.0,
+    ):
+        self.clock = clock or VirtualClock()
+        self.track_length = track_length
+        self.playlist: List[Dict[str, Any]] = []
+        self.current: Optional[int] = None
+        self.state = "stopped"
+        self.volume = 256
+        self.fullscreen = False
+        self.commands = 0
+        # VLC numbers playlist items from a few ids in
+        self._next_id = 4
+        # Time played before the last resume, and when that resume happened
+        self._played = 0.0
+        self._resumed_at = 0.0
+
+    def _elapsed(self) -> float:
+        if self.state == "playing":
+            return self._played + self.clock() - self._resumed_at
+
+        return self._played
+
+    def _start(self, index: Optional[int], played: float = 0.0):
+        self.current = index
+        self._played = played
+        self._resumed_at = self.clock()
+
+        if index is None:
+            self.state = "stopped"
+            self._played = 0.0
+
+    def _sync(self):
+        # Move through every item that has finished since the last request
+        while self.state == "playing" and self.current is not None:
+            overflow = self._elapsed() - self.playlist[self.current]["length"]
+            if overflow < 0:
+                return
+
+            next_index = self.current + 1
+            if next_index >= len(self.playlist):
+                self._start(None)
+                return
+
+            self._resumed_at = self.clock() - overflow
+            self._played = 0.0
+            self.current = next_index
+
+    def _enqueue(self, mrl: str) -> Optional[int]:
+        """Add an MRL to the playlist, returning the index of the first new item."""
+        if mrl.lower().endswith(".m3u"):
+            # Expand playlists the way VLC does
+            path = windows_path_to_wsl(filename_path(mrl))
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as file:
+                    lines = [line.strip() for line in file]
+
+                first = len(self.playlist)
+                for line in lines:
+                    if line and not line.startswith("#"):
+                        self._enqueue(line)
+
+                return first if first < len(self.playlist) else None
+
+        self.playlist.append(
+            {
+                "id": self._next_id,
+                "mrl": mrl,
+                "name": filename_from_mrl(mrl.split("#", 1)[0]),
+                "length": float(self.track_length(mrl)),
+            }
+        )
+        self._next_id += 1
+        return len(self.playlist) - 1
+
+    def command(self, name: str, params: Dict[str, str]):
+        self.commands += 1
+        self._sync()
+
+        if name == "in_enqueue":
+            self._enqueue(params["input"])
+        elif name == "in_play":
+            index = self._enqueue(params["input"])
+            if index is not None:
+                self._start(index)
+                self.state = "playing"
+        elif name == "pl_play":
+            if "id" in params:
+                ids = [item["id"] for item in self.playlist]
+                if int(params["id"]) in ids:
+                    self._start(ids.index(int(params["id"])))
+                    self.state = "playing"
+            elif self.state == "paused":
+                self._resumed_at = self.clock()
+                self.state = "playing"
+            elif self.state == "stopped" and self.playlist:
+                self._start(self.current or 0)
+                self.state = "playing"
+        elif name in ("pl_pause", "pl_forcepause", "pl_forceresume"):
+            if self.state == "playing" and name != "pl_forceresume":
+                self._played = self._elapsed()
+                self.state = "paused"
+            elif self.state == "paused" and name != "pl_forcepause":
+                self._resumed_at = self.clock()
+                self.state = "playing"
+        elif name == "pl_stop":
+            self._played = 0.0
+            self.state = "stopped"
+        elif name in ("pl_next", "pl_previous") and self.current is not None:
+            step = 1 if name == "pl_next" else -1
+            index = self.current + step
+            if 0 <= index < len(self.playlist):
+                state = self.state
+                self._start(index)
+                self.state = state
+        elif name == "pl_empty":
+            self.playlist = []
+            self._start(None)
+        elif name == "volume":
+            value = params.get("val", "")
+            if value.startswith(("+", "-")):
+                self.volume = max(0, self.volume + int(value))
+            elif value:
+                self.volume = max(0, int(value))
+        elif name == "fullscreen":
+            self.fullscreen = not self.fullscreen
+        elif name == "seek" and self.current is not None:
+            self._played = float(params.get("val", 0))
+            self._resumed_at = self.clock()
+
+    def status(self) -> Dict[str, Any]:
+        self._sync()
+
+        status: Dict[str, Any] = {
+            "apiversion": 3,
+            "version": "3.0.20 Vetinari (simulated)",
+            "state": self.state,
+            "volume": self.volume,
+            "fullscreen": self.fullscreen,
+            "random": False,
+            "loop": False,
+            "repeat": False,
+            "rate": 1,
+            "time": 0,
+            "length": 0,
+            "position": 0.0,
+            "currentplid": -1,
+        }
+
+        if self.current is not None:
+            item = self.playlist[self.current]
+            elapsed = min(self._elapsed(), item["length"])
+            status["time"] = int(elapsed)
+            status["length"] = int(item["length"])
+            status["position"] = elapsed / item["length"] if item["length"] else 0.0
+            status["currentplid"] = item["id"]
+            # VLC sends utf-8 filenames that end up decoded as latin1
+            status["information"] = {
+                "category": {
+                    "meta": {"filename": item["name"].encode("utf-8").decode("latin1")}
+                }
+            }
+
+        return status
+
+    def playlist_tree(self) -> Dict[str, Any]:
+        self._sync()
+        children = [
+            {
+                "type": "leaf",
+                "id": str(item["id"]),
+                "name": item["name"],
+                "uri": item["mrl"],
+                "duration": int(item["length"]),
+                **({"current": "current"} if index == self.current else {}),
+            }
+            for index, item in enumerate(self.playlist)
+        ]
+        return {
+            "type": "node",
+            "name": "",
+            "id": "1",
+            "children": [
+                {"type": "node", "name": "Playlist", "id": "2", "children": children},
+                {"type": "node", "name": "Media Library", "id": "3", "children": []},
+            ],
+        }
+
+    def handle(self, resource: str, params: Dict[str, str]) -> Dict[str, Any]:
+        """Answer a /requests/<resource>.json request."""
+        if resource == "playlist":
+            return self.playlist_tree()
+
+        if "command" in params:
+            self.command(params["command"], params)
+
+        return self.status()
+
+
+class InProcessVLC(HttpVLCExt):
+    """An HttpVLCExt wired straight to a SimulatedVLC, without any HTTP."""
+
+    def __init__(self, simulator: Optional[SimulatedVLC] = None, **kwargs):
+        self.simulator = simulator or SimulatedVLC()
+        kwargs.setdefault("host", "http://in-process")
+        super().__init__(**kwargs)
+
+    def send_request(self, resource, param=""):
+        params = {
+            key: values[0] for key, values in urllib.parse.parse_qs(param).items()
+        }
+        return self.simulator.handle(resource, params)
+
+
+class FakeVLCRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like VLC, so HttpVLCExt's pooled session is exercised
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, which Nagle would hold back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status, body = self.server.fake_vlc.respond(
+            self.path, self.headers.get("Authorization")
+        )
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 401:
+            self.send_header("WWW-Authenticate", 'Basic realm="VLC stream"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # One line per poll would drown everything else out
+        pass
+
+
+class FakeVLCServer:
+    """
+    Serves a SimulatedVLC over VLC's HTTP interface, on a background thread.
+
+    Each response is held back by `delay` seconds plus up to `jitter` more,
+    and a `failure_rate` fraction of requests get a 500 without the command
+    being applied, so the DJ can be run against slow or flaky players.
+    """
+
+    def __init__(
+        self,
+        simulator: Optional[SimulatedVLC] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        password: Optional[str] = None,
+        delay: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.simulator = simulator or SimulatedVLC()
+        self.password = password
+        self.delay = delay
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self._server = ThreadingHTTPServer((host, port), FakeVLCRequestHandler)
+        self._server.daemon_threads = True
+        self._server.fake_vlc = self
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, name="fake-vlc", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "FakeVLCServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def authorized(self, authorization: Optional[str]) -> bool:
+        if self.password is None:
+            return True
+
+        # VLC only checks the password; the user name is always empty
+        credentials = base64.b64encode(f":{self.password}".encode()).decode()
+        return authorization == f"Basic {credentials}"
+
+    def respond(
+        self, path: str, authorization: Optional[str]
+    ) -> Tuple[int, Dict[str, Any]]:
+        url = urllib.parse.urlsplit(path)
+        match = re.fullmatch(r"/requests/(status|playlist)\.json", url.path)
+
+        with self._lock:
+            self.requests += 1
+            delay = self.delay + self._rng.uniform(0, self.jitter)
+            failed = self._rng.random() < self.failure_rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if not self.authorized(authorization):
+            return 401, {"error": "Unauthorized"}
+
+        if match is None:
+            return 404, {"error": f"Not found: {url.path}"}
+
+        params = {
+            key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()
+        }
+
+        # The simulator isn't thread-safe, and requests come in on their own threads
+        with self._lock:
+            if failed:
+                self.failures += 1
+                return 500, {"error": "Simulated failure"}
+
+            return 200, self.simulator.handle(match.group(1), params)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve simulated VLC players for the DJ to control."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--audio-port", type=int, default=8081)
+    parser.add_argument("--password", default=None)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="How much faster than real time"
+    )
+    parser.add_argument("--min-length", type=float, default=30.0)
+    parser.add_argument("--max-length", type=float, default=300.0)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    clock = ScaledClock(args.speed)
+    rng = random.Random(args.seed)
+
+    def track_length(mrl: str) -> float:
+        return rng.uniform(args.min_length, args.max_length)
+
+    servers = [
+        FakeVLCServer(
+            SimulatedVLC(clock, track_length),
+            host=args.host,
+            port=port,
+            password=args.password,
+            delay=args.delay_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            failure_rate=args.failure_rate,
+            seed=args.seed,
+        )
+        for port in (args.port, args.audio_port)
+    ]
+
+    for server in servers:
+        server.start()
+        print(f"Simulated VLC listening on {server.url}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.stop()
+            print(f"{server.url}: {server.requests} requests, {server.failures} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import atexit
+import queue
+import sqlite3
+import threading
+from collections import deque
+from contextlib import closing
+from typing import Deque, Iterator, List, Optional
+from constants import PlaybackMode
+from models import PlaybackInfo
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+class HistoryRecord:
+    """What the history keeps about one play: no Entry, paths or VLC metadata."""
+
+    __slots__ = ("entry_id", "playback_mode", "start_time", "end_time", "is_muted")
+
+    def __init__(
+        self,
+        entry_id: int,
+        playback_mode: PlaybackMode,
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        is_muted: bool = False,
+    ):
+        self.entry_id = entry_id
+        self.playback_mode = playback_mode
+        self.start_time = start_time
+        self.end_time = end_time
+        self.is_muted = is_muted
+
+    @property
+    def played_at(self) -> Optional[float]:
+        """When the play ended, or when it started if it never finished."""
+        return self.end_time if self.end_time is not None else self.start_time
+
+    @classmethod
+    def from_playback_info(cls, info: PlaybackInfo) -> "HistoryRecord":
+        return cls(
+            info.entry.id,
+            info.playback_mode,
+            info.start_time,
+            info.end_time,
+            info.is_muted,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"HistoryRecord(entry_id={self.entry_id}, "
+            f"playback_mode={self.playback_mode!r}, start_time={self.start_time}, "
+            f"end_time={self.end_time}, is_muted={self.is_muted})"
+        )
+
+
+class HistoryStore:
+    """
+    Durable play history in an SQLite database, shared across restarts.
+
+    Records are written by a background thread, so adding one never waits
+    on the disk. Reads open their own connection and only see records that
+    have already been written; call flush() first to wait for those.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pending: "queue.Queue[Optional[HistoryRecord]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        with closing(self._connect()) as connection:
+            # Lets the reads go on while the writer thread is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS plays (
+                    entry_id INTEGER NOT NULL,
+                    playback_mode TEXT NOT NULL,
+                    start_time REAL,
+                    end_time REAL,
+                    is_muted INTEGER NOT NULL
+                );
+                DROP INDEX IF EXISTS plays_by_entry;
+                DROP INDEX IF EXISTS plays_by_time;
+                CREATE INDEX IF NOT EXISTS plays_by_played_at
+                    ON plays (playback_mode, COALESCE(end_time, start_time));
+                """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10.0)
+
+    def add(self, record: HistoryRecord):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="history-writer", daemon=True
+                )
+                self._writer.start()
+                # Write out whatever is still pending when the DJ exits
+                atexit.register(self.close)
+
+        self._pending.put(record)
+
+    def _write_loop(self):
+        connection = self._connect()
+        try:
+            while True:
+                record = self._pending.get()
+                batch = [record]
+
+                # Write everything that piled up in one transaction
+                while record is not None and not self._pending.empty():
+                    record = self._pending.get()
+                    batch.append(record)
+
+                rows = [
+                    (
+                        item.entry_id,
+                        str(item.playback_mode),
+                        item.start_time,
+                        item.end_time,
+                        item.is_muted,
+                    )
+                    for item in batch
+                    if item is not None
+                ]
+
+                try:
+                    with connection:
+                        connection.executemany(
+                            "INSERT INTO plays VALUES (?, ?, ?, ?, ?)", rows
+                        )
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not write play history to {self.path}: {e}")
+                finally:
+                    for _ in batch:
+                        self._pending.task_done()
+
+                if record is None:
+                    return
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Wait until every added record has been written."""
+        self._pending.join()
+
+    def close(self):
+        with self._lock:
+            writer = self._writer
+            self._writer = None
+
+        if writer is not None:
+            self._pending.put(None)
+            writer.join()
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with closing(self._connect()) as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def _records(self, sql: str, params: tuple = ()) -> List[HistoryRecord]:
+        return [
+            HistoryRecord(entry_id, PlaybackMode(mode), start, end, bool(is_muted))
+            for entry_id, mode, start, end, is_muted in self._query(sql, params)
+        ]
+
+    def count(self, playback_mode: PlaybackMode) -> int:
+        ((count,),) = self._query(
+            "SELECT COUNT(*) FROM plays WHERE playback_mode = ?",
+            (str(playback_mode),),
+        )
+        return count
+
+    def recent(self, playback_mode: PlaybackMode, limit: int) -> List[HistoryRecord]:
+        """The last `limit` plays, oldest first."""
+        records = self._records(
+            "SELECT * FROM plays WHERE playback_mode = ? "
+            "ORDER BY rowid DESC LIMIT ?",
+            (str(playback_mode), limit),
+        )
+        records.reverse()
+        return records
+
+    def plays_between(
+        self, playback_mode: PlaybackMode, start_time: float, end_time: float
+    ) -> List[HistoryRecord]:
+        """Plays whose played_at falls in [start_time, end_time), oldest first."""
+        return self._records(
+            "SELECT * FROM plays WHERE playback_mode = ? "
+            "AND COALESCE(end_time, start_time) >= ? "
+            "AND COALESCE(end_time, start_time) < ? "
+            "ORDER BY COALESCE(end_time, start_time)",
+            (str(playback_mode), start_time, end_time),
+        )
+
+
+class PlayHistory:
+    """
+    Bounded play history.
+
+    The most recent `capacity` records are kept in a ring buffer, so memory
+    stays constant however long the DJ runs. With a store, every record is
+    also saved there, and the older ones can still be looked up from it.
+    """
+
+    def __init__(
+        self,
+        playback_mode: PlaybackMode,
+        capacity: int = 500,
+        store: Optional[HistoryStore] = None,
+    ):
+        if capacity <= 0:
+            raise ValueError("History capacity must be positive")
+
+        self.playback_mode = playback_mode
+        self.records: Deque[HistoryRecord] = deque(maxlen=capacity)
+        self.store = store
+        # Every record ever added, including the ones no longer in memory
+        self.count = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.records.maxlen
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[HistoryRecord]:
+        """The records still in memory, oldest first."""
+        return iter(self.records)
+
+    def load(self):
+        """Pick up where the previous run's history left off."""
+        if self.store is None:
+            return
+
+        self.records.extend(self.store.recent(self.playback_mode, self.capacity))
+        self.count = self.store.count(self.playback_mode)
+
+    def append(self, record: HistoryRecord):
+        self.records.append(record)
+        self.count += 1
+
+        if self.store is not None:
+            self.store.add(record)
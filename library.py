@@ -0,0 +1,560 @@
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+from pydantic import BaseModel
+from constants import ALL_TAGS_BY_ID, BASE_TAGS
+from models import EntryStore
+from tags import TagIndex
+from utils import indices_from_bitset, windows_path_to_wsl
+import utils
+
+logger = utils.get_logger(__name__)
+
+# Bump whenever the snapshot layout or the classification rules change
+SNAPSHOT_VERSION = 2
+SNAPSHOT_MAGIC = b"AMDJSNAP"
+
+# Below this size, starting worker processes costs more than it saves
+PARALLEL_MIN_BYTES = 8 << 20
+ENTRIES_START = re.compile(rb'"entries"\s*:\s*\[')
+ENTRY_START = re.compile(rb",\s*\{")
+WHITESPACE = re.compile(r"\s*")
+
+
+def tagstudio_file_path(base_path: str) -> str:
+    tagstudio_file = os.path.join(base_path, ".TagStudio", "ts_library.json")
+    return windows_path_to_wsl(tagstudio_file)
+
+
+def snapshot_path(tagstudio_file: str) -> str:
+    return os.path.splitext(tagstudio_file)[0] + ".djcache"
+
+
+def snapshot_key(tagstudio_file: str) -> Dict[str, Any]:
+    stat = os.stat(tagstudio_file)
+    return {
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+class JsonStream:
+    """
+    Incremental reader for a JSON document, decoding one value at a time.
+
+    Only as much of the file as the current value needs is kept in memory.
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int = 1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size: int) -> bool:
+        if self.eof:
+            return False
+
+        # Drop everything that has already been consumed
+        if self.pos:
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer += chunk
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self._fill(self.chunk_size):
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char!r}")
+
+        self.pos += 1
+        return char
+
+    def decode(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Grow the read size with the value so large values stay linear
+                if not self._fill(max(self.chunk_size, len(self.buffer))):
+                    raise
+
+                continue
+
+            # A number at the very end of the buffer might continue in the next chunk
+            if end == len(self.buffer) and self._fill(self.chunk_size):
+                continue
+
+            self.pos = end
+            return value
+
+
+def stream_library(
+    file: TextIO, chunk_size: int = 1 << 16
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield the top-level (key, value) pairs of a ts_library.json file.
+
+    The entries array is never held in memory as a whole: each entry is
+    yielded on its own as ("entries", entry_dict).
+    """
+    stream = JsonStream(file, chunk_size)
+    stream.expect("{")
+
+    if stream.peek() == "}":
+        return
+
+    while True:
+        key = stream.decode()
+        stream.expect(":")
+
+        if key == "entries":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    yield key, stream.decode()
+                    if stream.expect(",]") == "]":
+                        break
+        else:
+            yield key, stream.decode()
+
+        if stream.expect(",}") == "}":
+            return
+
+
+def find_entry_start(
+    data: bytes, pos: int, max_candidates: int = 1000
+) -> Optional[int]:
+    """
+    Find the start of an entry object at or after pos, without parsing up to it.
+
+    This only looks like an entry boundary; index_shard checks that it really
+    is one, by parsing the shard before it right up to it.
+    """
+    decoder = json.JSONDecoder()
+    for i, match in enumerate(ENTRY_START.finditer(data, pos)):
+        if i >= max_candidates:
+            break
+
+        start = match.end() - 1
+        window = data[start : start + (1 << 16)].decode("utf-8", "ignore")
+        try:
+            value, _ = decoder.raw_decode(window)
+        except json.JSONDecodeError:
+            continue
+
+        if isinstance(value, dict) and "id" in value and "filename" in value:
+            return start
+
+    return None
+
+
+def index_shard(
+    tagstudio_file: str, start: int, stop: Optional[int]
+) -> Tuple[Dict[str, Any], Dict[str, bytes], Optional[int]]:
+    """
+    Parse and index the entries between two byte offsets of ts_library.json.
+
+    Runs in a worker process. The shard has to end exactly where the next one
+    starts (or, for the last one, at the end of the entries array), otherwise
+    ValueError is raised. Returns the shard store as snapshot blobs, plus the
+    offset just past the entries array for the last shard.
+    """
+    with open(tagstudio_file, "rb") as file:
+        file.seek(start)
+        raw = file.read() if stop is None else file.read(stop - start)
+
+    text = raw.decode("utf-8")
+    decoder = json.JSONDecoder()
+    store = EntryStore()
+    pos = WHITESPACE.match(text).end()
+
+    # An empty array, when there's a single shard
+    if stop is None and text.startswith("]", pos):
+        array_end = start + len(raw) - len(text[pos + 1 :].encode("utf-8"))
+        meta, blobs = store.to_snapshot()
+        return meta, blobs, array_end
+
+    while True:
+        entry, pos = decoder.raw_decode(text, pos)
+        store.append(entry)
+
+        pos = WHITESPACE.match(text, pos).end()
+        if pos == len(text):
+            raise ValueError(f"Shard at {start} ends in the middle of an entry")
+
+        if text[pos] == "]":
+            if stop is not None:
+                raise ValueError(f"Entries end before the shard at {start} does")
+
+            array_end = start + len(raw) - len(text[pos + 1 :].encode("utf-8"))
+            break
+
+        if text[pos] != ",":
+            raise ValueError(f"Unexpected {text[pos]!r} between entries")
+
+        pos = WHITESPACE.match(text, pos + 1).end()
+        if stop is not None and pos == len(text):
+            array_end = None
+            break
+
+    meta, blobs = store.to_snapshot()
+    return meta, blobs, array_end
+
+
+class LibraryDiff(BaseModel):
+    added: List[int] = []
+    removed: List[int] = []
+    changed: List[int] = []
+    tags_changed: bool = False
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed or self.tags_changed)
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.removed)} removed, "
+            f"{len(self.changed)} changed, tags changed: {self.tags_changed}"
+        )
+
+
+class Library:
+    """The parts of a TagStudio library the DJ needs, in compact form."""
+
+    def __init__(
+        self,
+        tags: List[Dict[str, Any]],
+        fields: List[Dict[str, Any]],
+        store: EntryStore,
+        source_key: Optional[Dict[str, Any]] = None,
+    ):
+        self.tags = tags
+        self.fields = fields
+        self.store = store
+        # Identifies the version of ts_library.json this was loaded from
+        self.source_key = source_key
+        # Held by anything that reads the store off the DJ loop's thread, like the
+        # look-ahead planner, and while a reload changes it
+        self.lock = threading.RLock()
+
+    @property
+    def tag_index(self) -> TagIndex:
+        return self.store.tag_index
+
+    @classmethod
+    def load(
+        cls,
+        tagstudio_file: str,
+        use_snapshot: bool = True,
+        workers: Optional[int] = None,
+    ) -> "Library":
+        if use_snapshot:
+            library = cls.read_snapshot(tagstudio_file)
+            if library is not None:
+                return library
+
+        library = cls.parse(tagstudio_file, workers)
+
+        if use_snapshot:
+            library.write_snapshot(tagstudio_file)
+
+        return library
+
+    @classmethod
+    def parse(cls, tagstudio_file: str, workers: Optional[int] = None) -> "Library":
+        # Stat before reading so that a write during the parse isn't missed
+        source_key = snapshot_key(tagstudio_file)
+
+        library = None
+        if (
+            workers is not None
+            and workers > 1
+            and source_key["size"] >= PARALLEL_MIN_BYTES
+        ):
+            try:
+                library = cls._read_parallel(tagstudio_file, source_key, workers)
+            except (OSError, ValueError, BrokenProcessPool) as e:
+                logger.warning(f"Parallel indexing failed, indexing serially: {e}")
+
+        if library is None:
+            library = cls._read(tagstudio_file, source_key)
+
+        # The tags can come after the entries, so classify once everything is read
+        library.tag_index.update_tags(library.tags)
+        library.store.classify()
+
+        return library
+
+    @classmethod
+    def _read(cls, tagstudio_file: str, source_key: Dict[str, Any]) -> "Library":
+        """Read the library without classifying it."""
+        tags: List[Dict[str, Any]] = []
+        fields: List[Dict[str, Any]] = []
+
+        # Library tags take precedence over base tags with the same id
+        store = EntryStore(TagIndex(BASE_TAGS))
+
+        with open(tagstudio_file, "r") as file:
+            for key, value in stream_library(file):
+                if key == "entries":
+                    store.append(value)
+                elif key == "tags":
+                    tags = value
+                elif key == "fields":
+                    fields = value
+
+        return cls(tags, fields, store, source_key)
+
+    @classmethod
+    def _read_parallel(
+        cls, tagstudio_file: str, source_key: Dict[str, Any], workers: int
+    ) -> "Library":
+        """
+        Read the library with the entries split across worker processes.
+
+        Each worker parses and indexes its own byte range of the entries array
+        and sends back the compact columns and row bitsets, which are then
+        stitched together in order. Like _read, this doesn't classify.
+        """
+        with open(tagstudio_file, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            match = ENTRIES_START.search(data)
+            if match is None:
+                raise ValueError("Could not find the entries array")
+
+            array_start = match.end()
+            size = len(data)
+            bounds = [array_start]
+            for shard in range(1, workers):
+                boundary = find_entry_start(
+                    data, array_start + (size - array_start) * shard // workers
+                )
+                if boundary is not None and boundary > bounds[-1]:
+                    bounds.append(boundary)
+
+            head = data[: array_start - 1]
+
+        with ProcessPoolExecutor(max_workers=len(bounds)) as pool:
+            futures = [
+                pool.submit(index_shard, tagstudio_file, start, stop)
+                for start, stop in zip(bounds, bounds[1:] + [None])
+            ]
+            results = [future.result() for future in futures]
+
+        # Everything but the entries, with an empty array in their place
+        with open(tagstudio_file, "rb") as file:
+            file.seek(results[-1][2])
+            tail = file.read()
+
+        document = json.loads(head + b"[]" + tail)
+
+        store = EntryStore(TagIndex(BASE_TAGS))
+        for meta, blobs, _ in results:
+            store.extend(EntryStore.from_snapshot(meta, blobs))
+
+        logger.debug(f"Indexed {len(store)} entries in {len(bounds)} shards")
+        return cls(
+            document.get("tags", []), document.get("fields", []), store, source_key
+        )
+
+    def read_update(self, tagstudio_file: str) -> Optional["Library"]:
+        """
+        Read ts_library.json if it has changed, for apply_update.
+
+        This only reads, so it can run in another thread while the library is
+        in use.
+        """
+        source_key = snapshot_key(tagstudio_file)
+        if source_key == self.source_key:
+            return None
+
+        return self._read(tagstudio_file, source_key)
+
+    def apply_update(self, incoming: "Library") -> LibraryDiff:
+        """
+        Patch this library in place to match a freshly read one.
+
+        Only the entries that were added, removed or changed are touched in the
+        store. Rows are appended or marked as removed, so the row numbers of
+        everything else stay valid.
+        """
+        diff = LibraryDiff()
+
+        removed_ids = [
+            entry_id
+            for entry_id in self.store.row_by_id
+            if entry_id not in incoming.store.row_by_id
+        ]
+        for entry_id in removed_ids:
+            self.store.remove(entry_id)
+            diff.removed.append(entry_id)
+
+        for row in indices_from_bitset(incoming.store.live_rows):
+            entry_id = incoming.store.ids[row]
+            old_row = self.store.row_by_id.get(entry_id)
+
+            if old_row is None:
+                diff.added.append(entry_id)
+            elif not self.store.same_row(old_row, incoming.store, row):
+                diff.changed.append(entry_id)
+            else:
+                continue
+
+            self.store.append_from(incoming.store, row)
+
+        old_tags = {tag["id"]: tag for tag in self.tags}
+        new_tags = {tag["id"]: tag for tag in incoming.tags}
+        changed_tags = [
+            tag for tag_id, tag in new_tags.items() if old_tags.get(tag_id) != tag
+        ]
+        removed_tag_ids = [tag_id for tag_id in old_tags if tag_id not in new_tags]
+
+        if changed_tags or removed_tag_ids:
+            diff.tags_changed = True
+            self.tag_index.remove_tags(removed_tag_ids)
+
+            # Base tags that were overridden by a removed library tag come back
+            restored_tags = [
+                ALL_TAGS_BY_ID[tag_id]
+                for tag_id in removed_tag_ids
+                if tag_id in ALL_TAGS_BY_ID
+            ]
+            self.tag_index.update_tags(restored_tags + changed_tags)
+
+        if not diff.is_empty:
+            self.store.classify()
+
+        self.tags = incoming.tags
+        self.fields = incoming.fields
+        self.source_key = incoming.source_key
+
+        return diff
+
+    def write_snapshot(self, tagstudio_file: str):
+        """
+        Save the compiled library next to ts_library.json.
+
+        Layout: magic, header length, JSON header, then the raw blobs. The
+        header records where each blob lives, so the file can be mapped and
+        sliced without parsing anything but the header.
+        """
+        # to_snapshot indexes any rows added since the last call
+        with self.lock:
+            store_meta, store_blobs = self.store.to_snapshot()
+
+        blob_offsets = {}
+        offset = 0
+        for name, blob in store_blobs.items():
+            blob_offsets[name] = [offset, len(blob)]
+            offset += len(blob)
+
+        header = json.dumps(
+            {
+                "key": self.source_key or snapshot_key(tagstudio_file),
+                "tags": self.tags,
+                "fields": self.fields,
+                "tag_index": self.tag_index.to_snapshot(),
+                "store": store_meta,
+                "blobs": blob_offsets,
+            }
+        ).encode("utf-8")
+
+        path = snapshot_path(tagstudio_file)
+        temp_path = None
+
+        try:
+            # A unique name, so processes starting together don't share a partial file
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix=".ts_snapshot_", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as file:
+                file.write(SNAPSHOT_MAGIC)
+                file.write(struct.pack("<Q", len(header)))
+                file.write(header)
+                for blob in store_blobs.values():
+                    file.write(blob)
+
+            # Swap it in atomically so a reader never sees a partial snapshot
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write library snapshot {path}: {e}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @classmethod
+    def read_snapshot(cls, tagstudio_file: str) -> Optional["Library"]:
+        path = snapshot_path(tagstudio_file)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as file, mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped:
+                if mapped[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                    return None
+
+                start = len(SNAPSHOT_MAGIC) + 8
+                (header_len,) = struct.unpack("<Q", mapped[len(SNAPSHOT_MAGIC) : start])
+                header = json.loads(mapped[start : start + header_len])
+
+                if header["key"] != snapshot_key(tagstudio_file):
+                    logger.info("Library snapshot is out of date, rebuilding...")
+                    return None
+
+                data = memoryview(mapped)[start + header_len :]
+                try:
+                    for name, (offset, length) in header["blobs"].items():
+                        if offset + length > len(data):
+                            raise ValueError(f"{name} is truncated")
+
+                    blobs = {
+                        name: data[offset : offset + length]
+                        for name, (offset, length) in header["blobs"].items()
+                    }
+                    tag_index = TagIndex.from_snapshot(header["tag_index"])
+                    store = EntryStore.from_snapshot(header["store"], blobs, tag_index)
+                finally:
+                    # Every view has to be released before the map can be closed
+                    blobs = None
+                    data.release()
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            # A truncated or corrupt snapshot is rebuilt from ts_library.json
+            logger.warning(f"Could not read library snapshot {path}: {e}")
+            return None
+
+        return cls(header["tags"], header["fields"], store, header["key"])
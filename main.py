@@ -1,7 +1,10 @@
+import asyncio
 import os
 from dj import AutoMediaDJ
 import dotenv
+from metrics import MetricsReporter, MetricsServer
 from vlc_ext import HttpVLCExt
+from zones import MultiZoneDJ
 
 
 if __name__ == "__main__":
@@ -17,24 +20,90 @@ if __name__ == "__main__":
     password_audio = os.getenv("VLC_AUDIO_PASSWORD", password)
 
     base_path = os.getenv("BASE_PATH")
+    watch_library = os.getenv("WATCH_LIBRARY", "false").lower() == "true"
+    use_async = os.getenv("DJ_ASYNC", "false").lower() == "true"
+    persist_history = os.getenv("PERSIST_HISTORY", "true").lower() == "true"
+    lookahead = int(os.getenv("LOOKAHEAD", 0))
+    index_workers = int(os.getenv("INDEX_WORKERS", 0))
+    prefetch_bytes = int(float(os.getenv("PREFETCH_MB", 0)) * (1 << 20))
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+    metrics_port = int(os.getenv("METRICS_PORT", 0))
+    metrics_log_interval = float(os.getenv("METRICS_LOG_INTERVAL", 0))
 
-    vlc = HttpVLCExt(
-        host=f"{base_host}:{port}",
-        password=password,
-    )
-    vlc2 = HttpVLCExt(
-        host=f"{base_audio_host}:{port_audio}",
-        password=password,
-    )
-
-    print(vlc.fetch_playlist())
-    print(vlc.fetch_status())
-    # print(vlc.fetch_data())
-
-    dj = AutoMediaDJ(
-        vlc=vlc,
-        vlc_audio=vlc2,
-        base_path=base_path,
-    )
-
-    dj.start()
+    # Timings, queue depths and state changes, for Prometheus or the log
+    if metrics_port:
+        MetricsServer(host=metrics_host, port=metrics_port).start()
+
+    if metrics_log_interval > 0:
+        MetricsReporter(metrics_log_interval).start()
+
+    # Batched enqueues go through playlist files that VLC reads from the library
+    playlist_dir = None
+    if os.getenv("BATCH_ENQUEUE", "false").lower() == "true":
+        playlist_dir = os.path.join(base_path, ".TagStudio")
+
+    zone_names = [name.strip() for name in os.getenv("ZONES", "").split(",")]
+    zone_names = [name for name in zone_names if name]
+    if zone_names:
+        # Each zone's settings are the usual ones, prefixed with the zone name
+        multi_dj = MultiZoneDJ(
+            base_path, index_workers=index_workers, watch_library=watch_library
+        )
+        for name in zone_names:
+            prefix = f"{name.upper()}_"
+            zone_host = os.getenv(f"{prefix}VLC_HOST", base_host)
+            zone_audio_host = os.getenv(f"{prefix}VLC_AUDIO_HOST", zone_host)
+            zone_password = os.getenv(f"{prefix}VLC_PASSWORD", password)
+            zone_password_audio = os.getenv(
+                f"{prefix}VLC_AUDIO_PASSWORD", zone_password
+            )
+
+            multi_dj.add_zone(
+                name,
+                HttpVLCExt(
+                    host=f"{zone_host}:{os.getenv(f'{prefix}VLC_PORT', port)}",
+                    password=zone_password,
+                    playlist_dir=playlist_dir,
+                ),
+                HttpVLCExt(
+                    host=f"{zone_audio_host}:{os.getenv(f'{prefix}VLC_AUDIO_PORT', port_audio)}",
+                    password=zone_password_audio,
+                    playlist_dir=playlist_dir,
+                ),
+                persist_history=persist_history,
+                lookahead=lookahead,
+                prefetch_bytes=prefetch_bytes,
+            )
+
+        asyncio.run(multi_dj.start())
+    else:
+        vlc = HttpVLCExt(
+            host=f"{base_host}:{port}",
+            password=password,
+            playlist_dir=playlist_dir,
+        )
+        vlc2 = HttpVLCExt(
+            host=f"{base_audio_host}:{port_audio}",
+            password=password,
+            playlist_dir=playlist_dir,
+        )
+
+        print(vlc.fetch_playlist())
+        print(vlc.fetch_status())
+        # print(vlc.fetch_data())
+
+        dj = AutoMediaDJ(
+            vlc=vlc,
+            vlc_audio=vlc2,
+            base_path=base_path,
+            watch_library=watch_library,
+            index_workers=index_workers,
+            persist_history=persist_history,
+            lookahead=lookahead,
+            prefetch_bytes=prefetch_bytes,
+        )
+
+        if use_async:
+            asyncio.run(dj.start_async())
+        else:
+            dj.start()
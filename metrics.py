@@ -0,0 +1,368 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+import utils
+
+logger = utils.get_logger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Seconds, from a fast in-memory choice up to a VLC request that timed out
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def label_key(labels: Dict[str, str]) -> LabelKey:
+    # Called on every observation, so label values are expected to be strings already
+    if len(labels) == 1:
+        return tuple(labels.items())
+
+    return tuple(sorted(labels.items()))
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+
+    return (
+        "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+    )
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self.values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines.extend(
+            f"{self.name}{format_labels(key)} {format_value(value)}"
+            for key, value in self.snapshot().items()
+        )
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[label_key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        # Per series: observations per bucket (the last one past every bucket),
+        # their sum and their count
+        self.series: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+
+            series[0][index] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def snapshot(self) -> Dict[LabelKey, Tuple[List[int], float, int]]:
+        with self._lock:
+            return {
+                key: (list(counts), totals[0], int(totals[1]))
+                for key, (counts, totals) in self.series.items()
+            }
+
+    def quantile(self, counts: List[int], count: int, fraction: float) -> float:
+        """Upper bound of the bucket the quantile falls in."""
+        rank = fraction * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, (counts, total, count) in self.snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{format_labels(key, ('le', format_value(bound)))}"
+                    f" {cumulative}"
+                )
+
+            lines.append(
+                f"{self.name}_bucket{format_labels(key, ('le', '+Inf'))} {count}"
+            )
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of one process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already exists")
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """A short, human readable digest of every metric, for the log."""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                for key, (counts, total, count) in metric.snapshot().items():
+                    if not count:
+                        continue
+
+                    p50 = metric.quantile(counts, count, 0.5)
+                    p99 = metric.quantile(counts, count, 0.99)
+                    lines.append(
+                        f"{metric.name}{format_labels(key)}: {count} calls,"
+                        f" mean {total / count * 1000:.2f}ms,"
+                        f" p50 <= {p50 * 1000:g}ms, p99 <= {p99 * 1000:g}ms"
+                    )
+            else:
+                lines.extend(
+                    f"{metric.name}{format_labels(key)}: {format_value(value)}"
+                    for key, value in metric.snapshot().items()
+                )
+
+        return "\n".join(lines)
+
+
+registry = MetricsRegistry()
+
+OPERATION_SECONDS = registry.histogram(
+    "dj_operation_seconds", "Time spent in the DJ's hot paths."
+)
+VLC_REQUEST_SECONDS = registry.histogram(
+    "vlc_request_seconds", "Time taken by requests to VLC's HTTP interface."
+)
+VLC_REQUEST_FAILURES = registry.counter(
+    "vlc_request_failures_total", "Requests to VLC that failed or were refused."
+)
+QUEUE_DEPTH = registry.gauge(
+    "dj_queue_depth", "Items queued on a player and not yet playing."
+)
+PLANNED_ITEMS = registry.gauge(
+    "dj_planned_items", "Items chosen ahead for a player by the look-ahead planner."
+)
+DJ_STATE = registry.gauge("dj_state", "1 for the DJ's current state, 0 otherwise.")
+STATE_TRANSITIONS = registry.counter(
+    "dj_state_transitions_total", "Changes of the DJ's state."
+)
+
+
+def timed(operation: str) -> Callable:
+    """
+    Time a DJ method into dj_operation_seconds.
+
+    The observation is labelled with the operation, and with whatever the
+    instance's `metric_labels` adds, e.g. its zone.
+    """
+
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await method(self, *args, **kwargs)
+                finally:
+                    OPERATION_SECONDS.observe(
+                        time.perf_counter() - start,
+                        operation=operation,
+                        **self.metric_labels,
+                    )
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                OPERATION_SECONDS.observe(
+                    time.perf_counter() - start,
+                    operation=operation,
+                    **self.metric_labels,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        data = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the log
+        pass
+
+
+class MetricsServer:
+    """Serves the registry at /metrics for Prometheus to scrape, on a background thread."""
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = registry,
+        host: str = "127.0.0.1",
+        port: int = 9464,
+    ):
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.registry = registry
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, name="metrics-server", daemon=True
+            )
+            self._thread.start()
+            logger.info(f"Serving metrics at {self.url}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class MetricsReporter:
+    """Writes a summary of the metrics to app.log every `interval` seconds."""
+
+    def __init__(self, interval: float, registry: MetricsRegistry = registry):
+        if interval <= 0:
+            raise ValueError("The reporting interval must be positive")
+
+        self.interval = interval
+        self.registry = registry
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="metrics-reporter", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            summary = self.registry.summary()
+            if summary:
+                # Debug, so it goes to app.log but not the console
+                logger.debug(f"Metrics so far:\n{summary}")
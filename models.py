@@ -1,34 +1,114 @@
-from typing import Any, Dict, List, Optional, Tuple
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from functools import cached_property
 from pydantic import BaseModel, computed_field
 from constants import (
     ALL_FIELDS_BY_ID,
+    CHECKBOX_FIELD_IDS,
     DJMode,
+    EntryFlag,
     FieldIds,
     PlaybackMode,
     TagId,
 )
 import os
 
-from utils import mrl_from_path, search_for_tag
+from tags import TagIndex, base_tag_index
+from utils import bitset_from_indices, indices_from_bitset, mrl_from_path
+
+# Each checkbox field gets one bit in EntryStore.checkboxes
+CHECKBOX_BITS = {field_id: 1 << i for i, field_id in enumerate(CHECKBOX_FIELD_IDS)}
+
+# The array columns of an EntryStore that are written to snapshots as-is
+SNAPSHOT_COLUMNS = [
+    "ids",
+    "checkboxes",
+    "has_meta_tags",
+    "content_tag_offsets",
+    "content_tag_ids",
+    "meta_tag_offsets",
+    "meta_tag_ids",
+    "flags",
+]
+
+
+class VlcPlayerDataSnapshot:
+    """
+    The parts of a VLC status response the DJ uses, extracted once.
+
+    The raw status payload is only kept when asked for, since it includes the
+    whole information/metadata tree.
+    """
+
+    __slots__ = (
+        "state",
+        "time",
+        "length",
+        "volume",
+        "position",
+        "current_id",
+        "information",
+        "filename",
+        "data",
+    )
+
+    def __init__(
+        self,
+        data: Dict[str, Any],
+        keep_raw: bool = False,
+        previous: Optional["VlcPlayerDataSnapshot"] = None,
+    ):
+        self.state: Optional[str] = data.get("state")
+        self.time: Optional[float] = data.get("time")
+        self.length: Optional[float] = data.get("length")
+        self.volume: Optional[float] = data.get("volume")
+        self.position: Optional[float] = data.get("position")
+        self.current_id: Optional[int] = data.get("currentplid")
+        self.data: Optional[Dict[str, Any]] = data if keep_raw else None
+
+        self.information: Optional[Dict[str, Any]] = data.get("information")
+        self.filename: Optional[str] = None
+
+        if self.information is None:
+            # A transitional status can leave out the metadata, so keep what the
+            # last complete status said about the same playlist item
+            if (
+                previous is not None
+                and previous.filename is not None
+                and self.current_id is not None
+                and self.current_id >= 0
+                and self.current_id == previous.current_id
+            ):
+                self.information = previous.information
+                self.filename = previous.filename
+
+            return
 
+        meta = self.metadata
+        if meta is not None:
+            filename = meta.get("filename")
 
-class VlcPlayerDataSnapshot(BaseModel):
-    data: Dict[str, Any]
+            # VLC sends utf-8 filenames that were decoded as latin1
+            if filename is not None:
+                self.filename = filename.encode("latin1").decode("utf-8")
 
-    @property
-    def filename(self) -> Optional[str]:
-        meta = self.metadata
+    def __repr__(self) -> str:
+        return (
+            f"VlcPlayerDataSnapshot(state={self.state!r}, time={self.time}, "
+            f"length={self.length}, volume={self.volume}, filename={self.filename!r})"
+        )
 
-        if meta is None:
+    @property
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        info = self.information
+        if info is None:
             return None
 
-        filename = meta.get("filename")
-
-        if filename is None:
+        category = info.get("category")
+        if category is None:
             return None
 
-        return filename.encode("latin1").decode("utf-8")
+        return category.get("meta")
 
     @property
     def duration(self) -> Optional[str]:
@@ -39,91 +119,512 @@ class VlcPlayerDataSnapshot(BaseModel):
 
         return meta.get("duration")
 
+    def _raw(self, key: str) -> Any:
+        if self.data is None:
+            return None
+
+        return self.data.get(key)
+
     @property
-    def state(self) -> str:
-        return self.data.get("state")
+    def stats(self) -> Optional[Dict[str, Any]]:
+        return self._raw("stats")
 
     @property
-    def stats(self) -> Dict[str, Any]:
-        return self.data.get("stats")
+    def loop(self) -> Optional[bool]:
+        return self._raw("loop")
 
     @property
-    def information(self) -> Dict[str, Any]:
-        return self.data.get("information")
+    def repeat(self) -> Optional[bool]:
+        return self._raw("repeat")
 
     @property
-    def metadata(self) -> Dict[str, Any]:
-        info = self.data.get("information")
-        if info is None:
-            return None
+    def random(self) -> Optional[bool]:
+        return self._raw("random")
+
+
+class EntryStore:
+    """
+    Column-oriented storage for the entries of a TagStudio library.
+
+    Each entry is a row index into flat arrays instead of a dict of its own.
+    Tag lists are stored CSR-style: the tags of row i are
+    tag_ids[tag_offsets[i] : tag_offsets[i + 1]].
+    """
+
+    def __init__(self, tag_index: TagIndex = base_tag_index):
+        self.tag_index = tag_index
+        self.ids = array("q")
+        self.filenames: List[str] = []
+        self.paths: List[str] = []
+        self.checkboxes = array("I")
+        self.has_meta_tags = array("B")
+        self.content_tag_offsets = array("I", [0])
+        self.content_tag_ids = array("q")
+        self.meta_tag_offsets = array("I", [0])
+        self.meta_tag_ids = array("q")
+        self.flags = array("B")
+        self.row_by_id: Dict[int, int] = {}
+        self.masks: Dict[EntryFlag, int] = {}
+        # Rows are never deleted, only marked as removed, so row numbers stay stable
+        self.removed_rows = 0
+        self._interned_paths: Dict[str, str] = {}
+        # Row bitsets by checkbox field and by directly applied tag
+        self._rows_by_checkbox: Dict[int, int] = {}
+        self._rows_by_content_tag: Dict[int, int] = {}
+        self._rows_by_meta_tag: Dict[int, int] = {}
+        self._indexed_rows = 0
+
+    @classmethod
+    def from_dicts(
+        cls,
+        entry_dicts: Iterable[Dict[str, Any]],
+        tag_index: TagIndex = base_tag_index,
+    ) -> "EntryStore":
+        store = cls(tag_index)
+        for entry_dict in entry_dicts:
+            store.append(entry_dict)
+
+        store.classify()
+        return store
+
+    def to_snapshot(self) -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+        """Split the store into JSON-able metadata and raw binary blobs."""
+        self._index_rows()
+
+        meta: Dict[str, Any] = {"size": len(self.ids), "columns": {}}
+        blobs: Dict[str, bytes] = {}
+
+        for name in SNAPSHOT_COLUMNS:
+            column = getattr(self, name)
+            meta["columns"][name] = [column.typecode, column.itemsize]
+            blobs[name] = column.tobytes()
+
+        # Filenames and paths can't contain NUL characters
+        blobs["filenames"] = "\0".join(self.filenames).encode("utf-8")
+        blobs["paths"] = "\0".join(self.paths).encode("utf-8")
+
+        blobs["removed"] = self.removed_rows.to_bytes(
+            (self.removed_rows.bit_length() + 7) // 8, "little"
+        )
 
-        category = info.get("category")
-        if category is None:
-            return None
+        for prefix, bitsets in (
+            ("mask", self.masks),
+            ("checkbox", self._rows_by_checkbox),
+            ("content_tag", self._rows_by_content_tag),
+            ("meta_tag", self._rows_by_meta_tag),
+        ):
+            for key, bitset in bitsets.items():
+                blobs[f"{prefix}:{int(key)}"] = bitset.to_bytes(
+                    (bitset.bit_length() + 7) // 8, "little"
+                )
 
-        return category.get("meta")
+        return meta, blobs
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        meta: Dict[str, Any],
+        blobs: Dict[str, memoryview],
+        tag_index: TagIndex = base_tag_index,
+    ) -> "EntryStore":
+        store = cls(tag_index)
+        size = meta["size"]
+
+        for name, (typecode, itemsize) in meta["columns"].items():
+            column = array(typecode)
+            if column.itemsize != itemsize:
+                raise ValueError(f"Snapshot column {name} has an incompatible type")
+
+            column.frombytes(blobs[name])
+            setattr(store, name, column)
+
+        if size:
+            store.filenames = bytes(blobs["filenames"]).decode("utf-8").split("\0")
+            paths = bytes(blobs["paths"]).decode("utf-8").split("\0")
+            store.paths = [
+                store._interned_paths.setdefault(path, path) for path in paths
+            ]
 
-    @property
-    def volume(self) -> float:
-        return self.data.get("volume")
+        for name, blob in blobs.items():
+            prefix, _, key = name.partition(":")
+            if prefix == "removed":
+                store.removed_rows = int.from_bytes(blob, "little")
+            elif prefix == "mask":
+                store.masks[EntryFlag(int(key))] = int.from_bytes(blob, "little")
+            elif prefix == "checkbox":
+                store._rows_by_checkbox[int(key)] = int.from_bytes(blob, "little")
+            elif prefix == "content_tag":
+                store._rows_by_content_tag[int(key)] = int.from_bytes(blob, "little")
+            elif prefix == "meta_tag":
+                store._rows_by_meta_tag[int(key)] = int.from_bytes(blob, "little")
+
+        store.row_by_id = {
+            store.ids[row]: row for row in indices_from_bitset(store.live_rows)
+        }
+        store._indexed_rows = size
+        return store
 
     @property
-    def position(self) -> float:
-        return self.data.get("position")
+    def live_rows(self) -> int:
+        """Bitset of the rows that haven't been removed."""
+        return ((1 << len(self.ids)) - 1) & ~self.removed_rows
+
+    def append(self, entry_dict: Dict[str, Any]) -> int:
+        content_tags = None
+        meta_tags = None
+        checkboxes = 0
+        seen_checkboxes = 0
+
+        # Only the first occurrence of each field counts
+        for field in entry_dict.get("fields", []):
+            for key, value in field.items():
+                field_id = int(key)
+
+                if field_id == FieldIds.CONTENT_TAGS:
+                    if content_tags is None:
+                        content_tags = value or []
+                elif field_id == FieldIds.META_TAGS:
+                    if meta_tags is None:
+                        meta_tags = value or []
+                elif field_id in CHECKBOX_BITS:
+                    bit = CHECKBOX_BITS[field_id]
+                    if not seen_checkboxes & bit:
+                        seen_checkboxes |= bit
+                        if value:
+                            checkboxes |= bit
+
+        return self._append_row(
+            entry_dict["id"],
+            entry_dict["filename"],
+            entry_dict.get("path", ""),
+            checkboxes,
+            content_tags,
+            meta_tags,
+        )
 
-    @property
-    def time(self) -> float:
-        return self.data.get("time")
+    def append_from(self, other: "EntryStore", row: int) -> int:
+        """Copy a row of another store into this one."""
+        return self._append_row(
+            other.ids[row],
+            other.filenames[row],
+            other.paths[row],
+            other.checkboxes[row],
+            other.content_tags(row),
+            other.meta_tags(row),
+        )
 
-    @property
-    def length(self) -> float:
-        return self.data.get("length")
+    def extend(self, other: "EntryStore"):
+        """Append every row of another store, in order, as if appended one by one."""
+        base = len(self.ids)
+        was_indexed = self._indexed_rows == base
 
-    @property
-    def loop(self) -> bool:
-        return self.data.get("loop")
+        self.ids.extend(other.ids)
+        self.filenames.extend(other.filenames)
+        self.paths.extend(
+            self._interned_paths.setdefault(path, path) for path in other.paths
+        )
+        self.checkboxes.extend(other.checkboxes)
+        self.has_meta_tags.extend(other.has_meta_tags)
+        self.flags.extend(array("B", bytes(len(other.ids))))
+
+        for offsets, tag_ids, other_offsets, other_tag_ids in (
+            (
+                self.content_tag_offsets,
+                self.content_tag_ids,
+                other.content_tag_offsets,
+                other.content_tag_ids,
+            ),
+            (
+                self.meta_tag_offsets,
+                self.meta_tag_ids,
+                other.meta_tag_offsets,
+                other.meta_tag_ids,
+            ),
+        ):
+            tag_base = len(tag_ids)
+            tag_ids.extend(other_tag_ids)
+            offsets.extend(offset + tag_base for offset in other_offsets[1:])
+
+        self.removed_rows |= other.removed_rows << base
+        for entry_id, row in other.row_by_id.items():
+            old_row = self.row_by_id.get(entry_id)
+            if old_row is not None:
+                self.removed_rows |= 1 << old_row
+
+            self.row_by_id[entry_id] = base + row
+
+        # Reuse the other store's row bitsets if both are fully indexed
+        if was_indexed and other._indexed_rows == len(other.ids):
+            for rows_by_key, other_rows_by_key in (
+                (self._rows_by_checkbox, other._rows_by_checkbox),
+                (self._rows_by_content_tag, other._rows_by_content_tag),
+                (self._rows_by_meta_tag, other._rows_by_meta_tag),
+            ):
+                for key, rows in other_rows_by_key.items():
+                    rows_by_key[key] = rows_by_key.get(key, 0) | (rows << base)
+
+            self._indexed_rows = len(self.ids)
+
+    def _append_row(
+        self,
+        entry_id: int,
+        filename: str,
+        path: str,
+        checkboxes: int,
+        content_tags: Optional[List[int]],
+        meta_tags: Optional[List[int]],
+    ) -> int:
+        row = len(self.ids)
+        self.ids.append(entry_id)
+        self.filenames.append(filename)
+        self.paths.append(self._interned_paths.setdefault(path, path))
+        self.checkboxes.append(checkboxes)
+        self.has_meta_tags.append(meta_tags is not None)
+        self.content_tag_ids.extend(content_tags or [])
+        self.content_tag_offsets.append(len(self.content_tag_ids))
+        self.meta_tag_ids.extend(meta_tags or [])
+        self.meta_tag_offsets.append(len(self.meta_tag_ids))
+        self.flags.append(0)
+
+        # A row that replaces an entry takes over its id
+        old_row = self.row_by_id.get(entry_id)
+        if old_row is not None:
+            self.removed_rows |= 1 << old_row
+
+        self.row_by_id[entry_id] = row
+
+        return row
+
+    def remove(self, entry_id: int):
+        row = self.row_by_id.pop(entry_id)
+        self.removed_rows |= 1 << row
+
+    def same_row(self, row: int, other: "EntryStore", other_row: int) -> bool:
+        """Whether two rows hold the same entry data, as far as the DJ cares."""
+        return (
+            self.ids[row] == other.ids[other_row]
+            and self.filenames[row] == other.filenames[other_row]
+            and self.paths[row] == other.paths[other_row]
+            and self.checkboxes[row] == other.checkboxes[other_row]
+            and self.content_tags(row) == other.content_tags(other_row)
+            and self.meta_tags(row) == other.meta_tags(other_row)
+        )
 
-    @property
-    def repeat(self) -> bool:
-        return self.data.get("repeat")
+    def __len__(self) -> int:
+        return len(self.row_by_id)
 
-    @property
-    def random(self) -> bool:
-        return self.data.get("random")
+    def __getitem__(self, row: int) -> "Entry":
+        return Entry(self, row)
 
+    def __iter__(self) -> Iterator["Entry"]:
+        return (Entry(self, row) for row in indices_from_bitset(self.live_rows))
 
-class Entry(BaseModel):
-    entry_dict: Dict[str, Any]
+    def entry(self, entry_id: int) -> "Entry":
+        return Entry(self, self.row_by_id[entry_id])
 
-    @computed_field
+    def content_tags(self, row: int) -> List[int]:
+        start, end = self.content_tag_offsets[row], self.content_tag_offsets[row + 1]
+        return self.content_tag_ids[start:end].tolist()
+
+    def meta_tags(self, row: int) -> Optional[List[int]]:
+        if not self.has_meta_tags[row]:
+            return None
+
+        start, end = self.meta_tag_offsets[row], self.meta_tag_offsets[row + 1]
+        return self.meta_tag_ids[start:end].tolist()
+
+    def classify(self):
+        """
+        (Re)compute the classification of every row.
+
+        Each predicate is evaluated for the whole library at once, as a bitset
+        over rows, from the per-checkbox and per-tag row bitsets.
+        """
+        self._index_rows()
+
+        all_rows = self.live_rows
+
+        def checked(field_id: int) -> int:
+            return self._rows_by_checkbox.get(field_id, 0)
+
+        def has_content_tag(tag_id: int) -> int:
+            return self._rows_with_tag(self._rows_by_content_tag, tag_id)
+
+        def has_meta_tag(tag_id: int) -> int:
+            return self._rows_with_tag(self._rows_by_meta_tag, tag_id)
+
+        archived = all_rows & (
+            checked(FieldIds.ARCHIVED) | has_meta_tag(TagId.ARCHIVED)
+        )
+
+        # It has music if it's tagged as such, or if it's tagged as music
+        has_music = all_rows & (
+            checked(FieldIds.HAS_MUSIC)
+            | has_content_tag(TagId.HAS_MUSIC)
+            | has_content_tag(TagId.MUSIC)
+        )
+
+        # It needs music to be background music, paired with visuals
+        background_music = has_music & (
+            checked(FieldIds.NEEDS_VISUALS)
+            | checked(FieldIds.OPTIONAL_VISUALS)
+            | has_content_tag(TagId.NEEDS_VISUALS)
+            | has_content_tag(TagId.HAS_OPTIONAL_VISUALS)
+        )
+
+        # It's not audiovisual if it's labeled as needing visuals. Otherwise it
+        # is, unless it's a silent video that isn't tagged as audiovisual
+        # (TODO: Do we need anything beyond this?)
+        audiovisual = (
+            all_rows
+            & ~checked(FieldIds.NEEDS_VISUALS)
+            & (
+                has_content_tag(TagId.AUDIOVISUAL_VIDEO)
+                | ~has_content_tag(TagId.SILENT_VIDEO)
+            )
+        )
+
+        # It's not visual if it's labeled as needing visuals
+        # Most things are visual by default (TODO: Needs more disqualifiers?)
+        visual = all_rows & ~(
+            checked(FieldIds.NEEDS_VISUALS) | has_content_tag(TagId.NEEDS_VISUALS)
+        )
+
+        self.masks = {
+            EntryFlag.ARCHIVED: archived,
+            EntryFlag.HAS_MUSIC: has_music,
+            EntryFlag.BACKGROUND_MUSIC: background_music,
+            EntryFlag.AUDIOVISUAL: audiovisual,
+            EntryFlag.VISUAL: visual,
+        }
+
+        # Keep the per-row flags in sync for Entry views
+        flags = bytearray(len(self.ids))
+        for flag, mask in self.masks.items():
+            bit = int(flag)
+            for row in indices_from_bitset(mask):
+                flags[row] |= bit
+
+        self.flags = array("B", flags)
+
+    def _index_rows(self):
+        """Add the rows appended since the last call to the row bitsets."""
+        start = self._indexed_rows
+        size = len(self.ids)
+        if start == size:
+            return
+
+        checkbox_rows: Dict[int, List[int]] = {}
+        for row in range(start, size):
+            checkboxes = self.checkboxes[row]
+            if not checkboxes:
+                continue
+
+            for field_id, bit in CHECKBOX_BITS.items():
+                if checkboxes & bit:
+                    checkbox_rows.setdefault(field_id, []).append(row)
+
+        for field_id, rows in checkbox_rows.items():
+            self._rows_by_checkbox[field_id] = self._rows_by_checkbox.get(
+                field_id, 0
+            ) | bitset_from_indices(rows, size)
+
+        for offsets, tag_ids, rows_by_tag in (
+            (self.content_tag_offsets, self.content_tag_ids, self._rows_by_content_tag),
+            (self.meta_tag_offsets, self.meta_tag_ids, self._rows_by_meta_tag),
+        ):
+            tag_rows: Dict[int, List[int]] = {}
+            for row in range(start, size):
+                for i in range(offsets[row], offsets[row + 1]):
+                    tag_rows.setdefault(tag_ids[i], []).append(row)
+
+            for tag_id, rows in tag_rows.items():
+                rows_by_tag[tag_id] = rows_by_tag.get(tag_id, 0) | bitset_from_indices(
+                    rows, size
+                )
+
+        self._indexed_rows = size
+
+    def _rows_with_tag(self, rows_by_tag: Dict[int, int], tag_id: int) -> int:
+        # Rows carrying any tag whose closure reaches tag_id
+        rows = 0
+        for root_tag_id, tag_rows in rows_by_tag.items():
+            if self.tag_index.has_tag(self.tag_index.closure(root_tag_id), tag_id):
+                rows |= tag_rows
+
+        return rows
+
+    def select_mask(
+        self,
+        include: EntryFlag = EntryFlag(0),
+        exclude: EntryFlag = EntryFlag(0),
+    ) -> int:
+        """Bitset of the rows that have every flag in include and none in exclude."""
+        mask = self.live_rows
+        for flag in EntryFlag(include):
+            mask &= self.masks[flag]
+
+        for flag in EntryFlag(exclude):
+            mask &= ~self.masks[flag]
+
+        return mask
+
+    def select(
+        self,
+        include: EntryFlag = EntryFlag(0),
+        exclude: EntryFlag = EntryFlag(0),
+    ) -> List["Entry"]:
+        mask = self.select_mask(include, exclude)
+        return [Entry(self, row) for row in indices_from_bitset(mask)]
+
+
+class Entry:
+    """A lightweight view of one row of an EntryStore."""
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: EntryStore, row: int):
+        self.store = store
+        self.row = row
+
+    @classmethod
+    def from_dict(
+        cls, entry_dict: Dict[str, Any], tag_index: TagIndex = base_tag_index
+    ) -> "Entry":
+        return EntryStore.from_dicts([entry_dict], tag_index)[0]
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Entry) and self.id == other.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def __repr__(self) -> str:
+        return f"Entry(id={self.id}, filename={self.filename!r})"
+
+    @property
+    def tag_index(self) -> TagIndex:
+        return self.store.tag_index
+
+    @property
     def id(self) -> int:
-        return self.entry_dict["id"]
+        return self.store.ids[self.row]
 
-    @computed_field
+    @property
     def filename(self) -> str:
-        return self.entry_dict["filename"]
+        return self.store.filenames[self.row]
 
-    @computed_field
+    @property
     def path(self) -> str:
-        return self.entry_dict.get("path", "")
+        return self.store.paths[self.row]
 
-    @computed_field
+    @property
     def content_tags(self) -> List[int]:
-        content_tags_key = str(FieldIds.CONTENT_TAGS)
-        fields = self.entry_dict.get("fields", [])
-        return next(
-            (field[content_tags_key] for field in fields if content_tags_key in field),
-            [],
-        )
+        return self.store.content_tags(self.row)
 
-    @computed_field
-    def meta_tags(self) -> List[int]:
-        meta_tags_key = str(FieldIds.META_TAGS)
-        fields = self.entry_dict.get("fields", [])
-        return next(
-            (field[meta_tags_key] for field in fields if meta_tags_key in field),
-            None,
-        )
+    @property
+    def meta_tags(self) -> Optional[List[int]]:
+        return self.store.meta_tags(self.row)
 
     def get_checkbox_val(self, field_id: int) -> bool:
         field = ALL_FIELDS_BY_ID[field_id]
@@ -131,100 +632,37 @@ class Entry(BaseModel):
         if field["type"] != "checkbox":
             raise ValueError("Field must be a checkbox")
 
-        field_key = str(field_id)
-        fields = self.entry_dict.get("fields", [])
-        checkbox_val = next(
-            (field[field_key] for field in fields if field_key in field),
-            False,
-        )
-        return checkbox_val
+        return self.store.checkboxes[self.row] & CHECKBOX_BITS[field_id] != 0
 
     def has_content_tag(self, tag_id: int) -> bool:
-        return search_for_tag(tag_id, self.content_tags)
+        return self.tag_index.has_tag(self.tag_index.mask(self.content_tags), tag_id)
 
     def has_meta_tag(self, tag_id: int) -> bool:
-        return search_for_tag(tag_id, self.meta_tags)
+        return self.tag_index.has_tag(self.tag_index.mask(self.meta_tags), tag_id)
 
-    @computed_field
+    @property
+    def flags(self) -> EntryFlag:
+        return EntryFlag(self.store.flags[self.row])
+
+    @property
     def is_archived(self) -> bool:
-        return self.get_checkbox_val(FieldIds.ARCHIVED) or self.has_meta_tag(
-            TagId.ARCHIVED
-        )
+        return EntryFlag.ARCHIVED in self.flags
 
-    @computed_field
+    @property
     def has_music(self) -> bool:
-        # It has music if it's tagged as such
-        if self.get_checkbox_val(FieldIds.HAS_MUSIC) or self.has_content_tag(
-            TagId.HAS_MUSIC
-        ):
-            return True
-
-        # It has music if it's tagged as music
-        if self.has_content_tag(TagId.MUSIC):
-            return True
+        return EntryFlag.HAS_MUSIC in self.flags
 
-        return False
-
-    @computed_field
+    @property
     def is_background_music(self) -> bool:
-        # It needs music to be background music
-        if not self.has_music:
-            return False
-
-        if (
-            self.get_checkbox_val(FieldIds.NEEDS_VISUALS)
-            or self.get_checkbox_val(FieldIds.OPTIONAL_VISUALS)
-            or self.has_content_tag(TagId.NEEDS_VISUALS)
-            or self.has_content_tag(TagId.HAS_OPTIONAL_VISUALS)
-        ):
-            return True
+        return EntryFlag.BACKGROUND_MUSIC in self.flags
 
-        # If it has music, but the visuals are important, it's not background music
-        return False
-
-    @computed_field
+    @property
     def is_audiovisual(self) -> bool:
-        # It's not audiovisual if it's labeled as needing visuals
-        if self.get_checkbox_val(FieldIds.NEEDS_VISUALS):
-            return False
-
-        # It's audiovisual if it's tagged as such (TODO: Do we need anything beyond this?)
-        if self.has_content_tag(TagId.AUDIOVISUAL_VIDEO):
-            return True
+        return EntryFlag.AUDIOVISUAL in self.flags
 
-        # It's not audiovisual if it's a silent video
-        if self.has_content_tag(TagId.SILENT_VIDEO):
-            return False
-
-        # If it's not tagged as needing visuals, and it's not a silent video, why isn't it tagged as audiovisual?
-        # This is a catch-all for anything that doesn't fit the above criteria
-        # Most things are audiovisual by default
-        return True
-
-    @computed_field
+    @property
     def is_visual(self) -> bool:
-        # It's not visual if it's labeled as needing visuals
-        if self.get_checkbox_val(FieldIds.NEEDS_VISUALS) or self.has_content_tag(
-            TagId.NEEDS_VISUALS
-        ):
-            return False
-
-        # It's visual if it's labeled as such or if it has optional audio
-        if self.get_checkbox_val(FieldIds.VISUALS) or self.get_checkbox_val(
-            FieldIds.OPTIONAL_AUDIO
-        ):
-            return True
-
-        # Images are only visual
-        if self.has_content_tag(TagId.IMAGE):
-            return True
-
-        # It's visual if it's tagged as such
-        if self.has_content_tag(TagId.VISUALS):
-            return True
-
-        # Most things are visual by default (TODO: Needs more disqualifiers?)
-        return True
+        return EntryFlag.VISUAL in self.flags
 
 
 class PlaybackInfo(BaseModel):
@@ -241,6 +679,10 @@ class PlaybackInfo(BaseModel):
     skip_chapters: Optional[List[int]] = None
     information: Optional[Dict[str, Any]] = None
 
+    # arbitrary types for pydantic
+    class Config:
+        arbitrary_types_allowed = True
+
     @computed_field
     @cached_property
     def chapter_ranges(self) -> Optional[List[Tuple[int, int]]]:
@@ -262,6 +704,10 @@ class PlaybackInfo(BaseModel):
             chapter_ranges.append((start_chapter, skip_chapter))
             start_chapter = skip_chapter + 1
 
+    @property
+    def file_path(self) -> str:
+        return os.path.join(self.base_path, self.entry.path, self.entry.filename)
+
     def get_mrls(self) -> List[str]:
         kwargs = {}
 
@@ -273,7 +719,7 @@ class PlaybackInfo(BaseModel):
         if self.chapter_ranges is not None:
             return [
                 mrl_from_path(
-                    os.path.join(self.base_path, self.entry.path, self.entry.filename),
+                    self.file_path,
                     **{
                         **kwargs,
                         "chapter": start,
@@ -287,7 +733,7 @@ class PlaybackInfo(BaseModel):
         # Mute the audio if specified in the playback info
         return [
             mrl_from_path(
-                os.path.join(self.base_path, self.entry.path, self.entry.filename),
+                self.file_path,
                 **kwargs,
             )
         ]
@@ -0,0 +1,123 @@
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+from constants import PlaybackMode
+from models import PlaybackInfo
+import utils
+
+logger = utils.get_logger(__name__)
+
+Chooser = Callable[[Set[int]], PlaybackInfo]
+
+
+class LookaheadPlanner:
+    """
+    Keeps up to `lookahead` items per playback mode chosen ahead of time.
+
+    The choosing happens on a background thread, so whoever needs the next
+    items can take them straight away instead of waiting on the selection.
+    Each mode is planned and taken on its own, since the players' queues don't
+    always need the same number of items. Its chooser is called with the entry
+    ids already planned for that mode, so it can avoid planning the same thing
+    twice, and while holding `lock`, so whatever it reads can't change under it.
+    """
+
+    def __init__(
+        self,
+        choosers: Dict[PlaybackMode, Chooser],
+        lookahead: int,
+        retry_interval: float = 1.0,
+        lock: Optional[threading.RLock] = None,
+    ):
+        if lookahead <= 0:
+            raise ValueError("The look-ahead must be positive")
+
+        self.choosers = choosers
+        self.lookahead = lookahead
+        self.retry_interval = retry_interval
+        self.lock = lock or threading.RLock()
+        self._ready: Dict[PlaybackMode, Deque[PlaybackInfo]] = {
+            mode: deque() for mode in choosers
+        }
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # Bumped by clear(), so an item chosen before it is thrown away
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return sum(len(ready) for ready in self._ready.values())
+
+    def planned(self, mode: PlaybackMode) -> int:
+        return len(self._ready[mode])
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, name="lookahead-planner", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            thread = self._thread
+            self._thread = None
+            self._running = False
+            self._condition.notify_all()
+
+        if thread is not None:
+            thread.join()
+
+    def _next_mode(self) -> Optional[PlaybackMode]:
+        # Top up whichever mode has the fewest items planned
+        mode = min(self._ready, key=lambda mode: len(self._ready[mode]))
+        return mode if len(self._ready[mode]) < self.lookahead else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._next_mode() is None:
+                    self._condition.wait()
+
+                if not self._running:
+                    return
+
+                generation = self._generation
+                mode = self._next_mode()
+                planned_ids = {info.entry.id for info in self._ready[mode]}
+
+            try:
+                with self.lock:
+                    info = self.choosers[mode](planned_ids)
+            except Exception as e:
+                # Most likely nothing to choose from yet; don't spin on it
+                logger.warning(f"Could not plan ahead: {e}")
+                with self._condition:
+                    self._condition.wait(self.retry_interval)
+                continue
+
+            with self._condition:
+                if generation == self._generation:
+                    self._ready[mode].append(info)
+
+    def take(self, mode: PlaybackMode, count: int) -> List[PlaybackInfo]:
+        """Take up to `count` planned items of a mode without waiting for more."""
+        with self._condition:
+            ready = self._ready[mode]
+            items = [ready.popleft() for _ in range(min(count, len(ready)))]
+            self._condition.notify_all()
+
+        return items
+
+    def clear(self):
+        """Drop everything planned so far, e.g. after the library changes."""
+        with self._condition:
+            for ready in self._ready.values():
+                ready.clear()
+
+            self._generation += 1
+            self._condition.notify_all()
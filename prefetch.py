@@ -0,0 +1,99 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+class MediaPrefetcher:
+    """
+    Warms the OS page cache with the start of files that are about to play.
+
+    Files are handled one at a time on a worker thread. Where the OS supports
+    it the kernel is asked to read ahead with posix_fadvise(WILLNEED), and the
+    head of the file is then read anyway, since network filesystems often
+    ignore the hint. Reads are capped at `head_bytes` per file and
+    `max_bytes_per_second` overall, and at most `max_pending` files wait in
+    line; anything past that is skipped rather than queued.
+    """
+
+    def __init__(
+        self,
+        head_bytes: int = 16 << 20,
+        max_bytes_per_second: float = 32 << 20,
+        max_pending: int = 16,
+        chunk_size: int = 1 << 20,
+    ):
+        self.head_bytes = head_bytes
+        self.max_bytes_per_second = max_bytes_per_second
+        self.chunk_size = chunk_size
+        self._pending: "queue.Queue[str]" = queue.Queue(maxsize=max_pending)
+        # Files prefetched lately, so a file queued twice in a row is read once
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.bytes_read = 0
+
+    def prefetch(self, path: str):
+        with self._lock:
+            if path in self._recent:
+                self._recent.move_to_end(path)
+                return
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="media-prefetcher", daemon=True
+                )
+                self._thread.start()
+
+            try:
+                self._pending.put_nowait(path)
+            except queue.Full:
+                # Not remembered, so it's tried again the next time it's queued
+                logger.debug(f"Prefetch queue is full, skipping {path}")
+                return
+
+            self._recent[path] = None
+            if len(self._recent) > 64:
+                self._recent.popitem(last=False)
+
+    def _run(self):
+        while True:
+            path = self._pending.get()
+            try:
+                self._prefetch_file(path)
+            except OSError as e:
+                logger.debug(f"Could not prefetch {path}: {e}")
+
+    def _prefetch_file(self, path: str):
+        started_at = time.monotonic()
+        read = 0
+
+        with open(path, "rb", buffering=0) as file:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(
+                    file.fileno(), 0, self.head_bytes, os.POSIX_FADV_WILLNEED
+                )
+
+            while read < self.head_bytes:
+                chunk = file.read(min(self.chunk_size, self.head_bytes - read))
+                if not chunk:
+                    break
+
+                read += len(chunk)
+                self.bytes_read += len(chunk)
+
+                # Stay within the I/O budget so playback itself isn't starved
+                ahead = read / self.max_bytes_per_second - (
+                    time.monotonic() - started_at
+                )
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        logger.debug(
+            f"Prefetched {read} bytes of {path} in {time.monotonic() - started_at:.2f}s"
+        )
@@ -0,0 +1,56 @@
+import math
+from typing import Dict, Hashable, Tuple
+
+
+class RecencyModel:
+    """
+    Play penalties that wear off over time.
+
+    Every key has a score and the time it was last played. A play adds
+    -log(penalty) to the score, and the score halves every `half_life`
+    seconds after that. The selection weight is exp(-score), so back-to-back
+    plays multiply together like fixed penalties would, while old plays fade
+    back towards a weight of 1.
+
+    Only the two numbers per key are stored, so recording a play and reading a
+    weight are both O(1), and weights are only worked out when they're needed.
+    """
+
+    def __init__(self, half_life: float):
+        if half_life <= 0:
+            raise ValueError("The half-life must be positive")
+
+        self.half_life = half_life
+        self._plays: Dict[Hashable, Tuple[float, float]] = {}
+
+    @property
+    def horizon(self) -> float:
+        """How long a single play keeps affecting the weight noticeably."""
+        return self.half_life * 20
+
+    def __len__(self) -> int:
+        return len(self._plays)
+
+    def score(self, key: Hashable, now: float) -> float:
+        play = self._plays.get(key)
+        if play is None:
+            return 0.0
+
+        last_played, score = play
+        elapsed = max(0.0, now - last_played)
+        return score * 0.5 ** (elapsed / self.half_life)
+
+    def weight(self, key: Hashable, now: float) -> float:
+        return math.exp(-self.score(key, now))
+
+    def add_play(self, key: Hashable, timestamp: float, penalty: float):
+        """Record a play that multiplies the key's current weight by `penalty`."""
+        play = self._plays.get(key)
+        if play is not None and play[0] > timestamp:
+            # Played out of order: decay the new play to the stored time instead
+            last_played, score = play
+            decay = 0.5 ** ((last_played - timestamp) / self.half_life)
+            self._plays[key] = (last_played, score - math.log(penalty) * decay)
+            return
+
+        self._plays[key] = (timestamp, self.score(key, timestamp) - math.log(penalty))
@@ -0,0 +1,142 @@
+import random
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class WeightedSampler:
+    """
+    Weighted random sampling over a set of keys, backed by a Fenwick tree.
+
+    Updating a weight, adding a key and drawing a key are all O(log n), so the
+    cost of a pick doesn't depend on rebuilding a distribution every time.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[Hashable] = (),
+        weights: Optional[Iterable[float]] = None,
+    ):
+        self._keys: List[Hashable] = list(keys)
+        self._index_by_key: Dict[Hashable, int] = {
+            key: index for index, key in enumerate(self._keys)
+        }
+
+        if weights is None:
+            self._weights = [1.0] * len(self._keys)
+        else:
+            self._weights = [float(weight) for weight in weights]
+
+        if len(self._weights) != len(self._keys):
+            raise ValueError("There must be exactly one weight per key")
+
+        self._rebuild()
+
+    def _rebuild(self):
+        # Linear-time construction: each node pushes its sum up to its parent
+        size = len(self._weights)
+        self._tree = [0.0] + self._weights
+
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+
+    def _prefix_sum(self, i: int) -> float:
+        # Sum of the first i weights
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+
+        return total
+
+    def _update(self, index: int, delta: float):
+        i = index + 1
+        size = len(self._weights)
+        while i <= size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index_by_key
+
+    @property
+    def total(self) -> float:
+        return self._prefix_sum(len(self._weights))
+
+    def add(self, key: Hashable, weight: float = 1.0):
+        if key in self._index_by_key:
+            self.set_weight(key, weight)
+            return
+
+        self._index_by_key[key] = len(self._keys)
+        self._keys.append(key)
+        self._weights.append(float(weight))
+
+        # The new node covers the range (i - lowbit(i), i]
+        i = len(self._weights)
+        self._tree.append(
+            weight + self._prefix_sum(i - 1) - self._prefix_sum(i - (i & -i))
+        )
+
+    def set_weight(self, key: Hashable, weight: float):
+        index = self._index_by_key[key]
+        delta = float(weight) - self._weights[index]
+        self._weights[index] = float(weight)
+        self._update(index, delta)
+
+    def sample(self, rng: random.Random = random) -> Hashable:
+        size = len(self._weights)
+        if size == 0 or self.total <= 0:
+            raise IndexError("Cannot sample from an empty sampler")
+
+        while True:
+            target = rng.random() * self.total
+
+            # Descend the tree to find the first index whose prefix sum exceeds the target
+            index = 0
+            step = 1 << (size.bit_length() - 1)
+            while step:
+                next_index = index + step
+                if next_index <= size and self._tree[next_index] <= target:
+                    target -= self._tree[next_index]
+                    index = next_index
+
+                step >>= 1
+
+            # Floating point drift can land past the end or on a disabled key
+            index = min(index, size - 1)
+            if self._weights[index] > 0:
+                return self._keys[index]
+
+    def sample_where(
+        self,
+        acceptance: Callable[[Hashable], float],
+        rng: random.Random = random,
+        max_attempts: int = 64,
+    ) -> Hashable:
+        """
+        Draw a key, further weighted by acceptance(key) in [0, 1].
+
+        The extra factor is applied by rejection, so it's usually only
+        evaluated for the few keys that get drawn. If nothing is accepted after
+        max_attempts draws, it's evaluated for every key and one is drawn
+        directly, which keeps the distribution exact when every factor is small.
+        """
+        for _ in range(max_attempts):
+            key = self.sample(rng)
+            if rng.random() < acceptance(key):
+                return key
+
+        keys = [key for key, weight in zip(self._keys, self._weights) if weight > 0]
+        weights = [
+            weight * acceptance(key)
+            for key, weight in zip(self._keys, self._weights)
+            if weight > 0
+        ]
+        if sum(weights) <= 0:
+            raise IndexError("Every key was rejected")
+
+        return rng.choices(keys, weights)[0]
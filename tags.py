@@ -0,0 +1,135 @@
+from typing import Any, Dict, Iterable, List, Optional
+from constants import BASE_TAGS
+
+
+class TagIndex:
+    """
+    Precomputed transitive closure of the tag hierarchy.
+
+    Every tag is assigned a bit, and each tag's closure is an integer bitset of
+    the tag itself plus every tag reachable through its subtag_ids. A set of
+    tags can then be collapsed into a single mask, and checking whether it
+    carries a tag (directly or through subtags) is a single bit test.
+    """
+
+    def __init__(self, tags: Iterable[Dict[str, Any]] = ()):
+        self.tags_by_id: Dict[int, Dict[str, Any]] = {}
+        self._bit_by_id: Dict[int, int] = {}
+        self._closure_by_id: Dict[int, int] = {}
+        self.update_tags(tags)
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        return {
+            "tags": list(self.tags_by_id.values()),
+            "bits": [
+                [tag_id, bit.bit_length() - 1]
+                for tag_id, bit in self._bit_by_id.items()
+            ],
+            "closures": [
+                [tag_id, format(closure, "x")]
+                for tag_id, closure in self._closure_by_id.items()
+            ],
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> "TagIndex":
+        tag_index = cls()
+        tag_index.tags_by_id = {tag["id"]: tag for tag in snapshot["tags"]}
+        tag_index._bit_by_id = {tag_id: 1 << pos for tag_id, pos in snapshot["bits"]}
+        tag_index._closure_by_id = {
+            tag_id: int(closure, 16) for tag_id, closure in snapshot["closures"]
+        }
+        return tag_index
+
+    def _bit(self, tag_id: int) -> int:
+        bit = self._bit_by_id.get(tag_id)
+        if bit is None:
+            # Unknown tags still get a bit so that they match themselves
+            bit = 1 << len(self._bit_by_id)
+            self._bit_by_id[tag_id] = bit
+
+        return bit
+
+    def _compute_closure(self, tag_id: int) -> int:
+        closure = 0
+        visited = {tag_id}
+        tag_queue = [tag_id]
+
+        while tag_queue:
+            curr_tag_id = tag_queue.pop()
+            closure |= self._bit(curr_tag_id)
+
+            # Reuse closures that are already complete instead of walking them again
+            if curr_tag_id != tag_id and curr_tag_id in self._closure_by_id:
+                closure |= self._closure_by_id[curr_tag_id]
+                continue
+
+            tag_data = self.tags_by_id.get(curr_tag_id)
+            if tag_data is None:
+                continue
+
+            for subtag_id in tag_data.get("subtag_ids") or []:
+                if subtag_id not in visited:
+                    visited.add(subtag_id)
+                    tag_queue.append(subtag_id)
+
+        return closure
+
+    def update_tags(self, tags: Iterable[Dict[str, Any]]):
+        """Add or replace tags, recomputing only the closures they affect."""
+        changed_mask = 0
+        for tag in tags:
+            self.tags_by_id[tag["id"]] = tag
+            changed_mask |= self._bit(tag["id"])
+
+        self._invalidate(changed_mask)
+
+    def remove_tags(self, tag_ids: Iterable[int]):
+        changed_mask = 0
+        for tag_id in tag_ids:
+            if self.tags_by_id.pop(tag_id, None) is not None:
+                changed_mask |= self._bit(tag_id)
+
+        self._invalidate(changed_mask)
+
+    def _invalidate(self, changed_mask: int):
+        if not changed_mask:
+            return
+
+        # Any tag whose closure reaches a changed tag has to be recomputed
+        stale_ids = [
+            tag_id
+            for tag_id, closure in self._closure_by_id.items()
+            if closure & changed_mask
+        ]
+        for tag_id in stale_ids:
+            del self._closure_by_id[tag_id]
+
+        for tag_id in self.tags_by_id:
+            if tag_id not in self._closure_by_id:
+                self._closure_by_id[tag_id] = self._compute_closure(tag_id)
+
+    def closure(self, tag_id: int) -> int:
+        closure = self._closure_by_id.get(tag_id)
+        if closure is None:
+            return self._bit(tag_id)
+
+        return closure
+
+    def mask(self, tag_ids: Optional[Iterable[int]]) -> int:
+        """Collapse a list of tags into a bitset of everything they imply."""
+        mask = 0
+        for tag_id in tag_ids or []:
+            mask |= self.closure(tag_id)
+
+        return mask
+
+    def has_tag(self, mask: int, tag_id: int) -> bool:
+        bit = self._bit_by_id.get(tag_id)
+        return bit is not None and mask & bit != 0
+
+    def search(self, tag_id: int, root_tags: Optional[List[int]]) -> bool:
+        return self.has_tag(self.mask(root_tags), tag_id)
+
+
+base_tag_index = TagIndex(BASE_TAGS)
@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURE_LIBRARY = os.path.join(os.path.dirname(__file__), "data", "ts_library.json")
+
+
+@pytest.fixture
+def library_document():
+    """The hand-built ts_library.json in tests/data, as a dict to modify."""
+    with open(FIXTURE_LIBRARY, encoding="utf-8") as file:
+        return json.load(file)
+
+
+@pytest.fixture
+def write_library(tmp_path):
+    """Write a library document to tmp_path/.TagStudio and return its path."""
+    tagstudio_file = tmp_path / ".TagStudio" / "ts_library.json"
+    tagstudio_file.parent.mkdir(exist_ok=True)
+    mtime_ns = [1_000_000_000_000_000_000]
+
+    def write(document):
+        with open(tagstudio_file, "w", encoding="utf-8") as file:
+            json.dump(document, file, indent=2)
+
+        # Every write looks like a change, even within the clock's resolution
+        mtime_ns[0] += 1_000_000_000
+        os.utime(tagstudio_file, ns=(mtime_ns[0], mtime_ns[0]))
+        return str(tagstudio_file)
+
+    return write
+
+
+@pytest.fixture
+def tagstudio_file(write_library, library_document):
+    return write_library(library_document)
@@ -0,0 +1,105 @@
+import os
+import pytest
+import python_vlc_http
+from bench import generate_library
+from dj import AutoMediaDJ
+from fake_vlc import InProcessVLC
+from metrics import OPERATION_SECONDS
+
+
+class FlakyVLC(InProcessVLC):
+    """Fails the in_enqueue requests numbered in `fail_on`, counting from 1."""
+
+    def __init__(self, fail_on=(), **kwargs):
+        self.fail_on = set(fail_on)
+        self.enqueues = 0
+        super().__init__(**kwargs)
+
+    def send_request(self, resource, param=""):
+        if param.startswith("command=in_enqueue"):
+            self.enqueues += 1
+            if self.enqueues in self.fail_on:
+                raise python_vlc_http.RequestFailed("Simulated failure")
+
+        return super().send_request(resource, param)
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_failed_enqueue_keeps_queues_in_sync(tmp_path, batch):
+    base_path = str(tmp_path)
+    generate_library(base_path, 200)
+    playlist_dir = os.path.join(base_path, ".TagStudio") if batch else None
+
+    vlc = FlakyVLC(fail_on={1}, playlist_dir=playlist_dir)
+    vlc_audio = FlakyVLC(fail_on={1}, playlist_dir=playlist_dir)
+    dj = AutoMediaDJ(
+        vlc=vlc,
+        vlc_audio=vlc_audio,
+        base_path=base_path,
+        use_library_snapshot=False,
+        persist_history=False,
+    )
+
+    failures = 0
+    for _ in range(4):
+        try:
+            dj.think()
+        except python_vlc_http.RequestFailed:
+            failures += 1
+
+    assert failures == 2
+    # Nothing is playing yet, so the players' playlists are exactly the queues
+    assert len(dj.video_queue) == len(vlc.simulator.playlist) == dj.queue_depth
+    assert len(dj.audio_queue) == len(vlc_audio.simulator.playlist) == dj.queue_depth
+    assert len(dj.play_history_audio) == len(dj.audio_queue)
+
+
+def test_queueing_is_timed(tmp_path):
+    base_path = str(tmp_path)
+    generate_library(base_path, 200)
+    dj = AutoMediaDJ(
+        vlc=InProcessVLC(),
+        vlc_audio=InProcessVLC(),
+        base_path=base_path,
+        use_library_snapshot=False,
+        persist_history=False,
+        zone="timed",
+    )
+    dj.think()
+
+    operations = {
+        dict(key)["operation"]
+        for key in OPERATION_SECONDS.snapshot()
+        if dict(key).get("zone") == "timed"
+    }
+    assert {"queue_videos", "queue_audios", "plan_batch"} <= operations
+
+
+class CountingDJ(AutoMediaDJ):
+    video_draws: int = 0
+
+    def choose_video(self, avoid=()):
+        self.video_draws += 1
+        return super().choose_video(avoid)
+
+
+def test_plan_batch_draws_each_player_separately(tmp_path):
+    base_path = str(tmp_path)
+    generate_library(base_path, 200)
+    dj = CountingDJ(
+        vlc=InProcessVLC(),
+        vlc_audio=InProcessVLC(),
+        base_path=base_path,
+        use_library_snapshot=False,
+        persist_history=False,
+    )
+    dj.think()
+    # The video player has got two items further than the audio player
+    del dj.video_queue[:2]
+    dj.video_draws = 0
+
+    videos, audios = dj.plan_batch()
+
+    assert len(videos) == 2
+    assert audios == []
+    assert dj.video_draws == 2
@@ -0,0 +1,34 @@
+from constants import PlaybackMode
+from history import HistoryRecord, HistoryStore
+
+
+def test_plays_between_uses_the_time_a_play_ended(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    # Started before the window but ended inside it
+    store.add(HistoryRecord(1, PlaybackMode.VIDEO, start_time=90.0, end_time=110.0))
+    # Started inside the window but ended after it
+    store.add(HistoryRecord(2, PlaybackMode.VIDEO, start_time=190.0, end_time=210.0))
+    # Never finished, so the start time is all there is
+    store.add(HistoryRecord(3, PlaybackMode.VIDEO, start_time=150.0))
+    # Only the end time was known, as for plays recorded from VLC mid-track
+    store.add(HistoryRecord(4, PlaybackMode.VIDEO, end_time=120.0))
+    store.add(HistoryRecord(5, PlaybackMode.AUDIO, start_time=100.0, end_time=130.0))
+    store.close()
+
+    records = store.plays_between(PlaybackMode.VIDEO, 100.0, 200.0)
+
+    assert [record.entry_id for record in records] == [1, 4, 3]
+    assert all(100.0 <= record.played_at < 200.0 for record in records)
+
+
+def test_plays_between_uses_the_played_at_index(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    plan = store._query(
+        "EXPLAIN QUERY PLAN SELECT * FROM plays WHERE playback_mode = ? "
+        "AND COALESCE(end_time, start_time) >= ? "
+        "AND COALESCE(end_time, start_time) < ? "
+        "ORDER BY COALESCE(end_time, start_time)",
+        ("video", 0.0, 1.0),
+    )
+
+    assert any("plays_by_played_at" in row[-1] for row in plan)
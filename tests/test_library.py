@@ -0,0 +1,288 @@
+import io
+import json
+import os
+import pytest
+from constants import EntryFlag, TagId
+from dj import AutoMediaDJ
+from fake_vlc import InProcessVLC
+from library import SNAPSHOT_MAGIC, Library, snapshot_path, stream_library
+from models import SNAPSHOT_COLUMNS
+
+
+def ids_with(library, flag):
+    return {entry.id for entry in library.store.select(include=flag)}
+
+
+def test_classification_follows_the_library_tag_graph(tagstudio_file):
+    library = Library.parse(tagstudio_file)
+
+    # Lo-fi -> Chill Music -> Music, only known from the library's own tags
+    assert ids_with(library, EntryFlag.HAS_MUSIC) == {2, 4, 6, 7, 8}
+    # Study Beats -> Needs Visuals
+    assert ids_with(library, EntryFlag.BACKGROUND_MUSIC) == {2, 4, 7, 8}
+    # Retired -> Archived, as a meta tag, and the Archived checkbox
+    assert ids_with(library, EntryFlag.ARCHIVED) == {5, 8}
+    # Mute Footage -> Silent Video
+    assert 3 not in ids_with(library, EntryFlag.AUDIOVISUAL)
+    assert ids_with(library, EntryFlag.VISUAL) == {1, 3, 5, 6, 7}
+
+
+def test_library_tags_override_base_tags(write_library, library_document):
+    # A library can give a base tag subtags of its own
+    library_document["tags"].append(
+        {"id": TagId.MEME, "name": "Meme", "subtag_ids": [TagId.MUSIC]}
+    )
+    library_document["entries"][0]["fields"] = [{"7": [TagId.MEME]}]
+
+    library = Library.parse(write_library(library_document))
+
+    assert 1 in ids_with(library, EntryFlag.HAS_MUSIC)
+
+
+def test_each_library_has_its_own_tag_graph(write_library, library_document):
+    library = Library.parse(write_library(library_document))
+
+    # Same tag ids, but Lo-fi no longer leads to Music
+    library_document["tags"][0]["subtag_ids"] = []
+    other = Library.parse(write_library(library_document))
+
+    assert library.tag_index is not other.tag_index
+    assert 6 in ids_with(library, EntryFlag.HAS_MUSIC)
+    assert 6 not in ids_with(other, EntryFlag.HAS_MUSIC)
+
+
+def expected_items(document):
+    for key, value in document.items():
+        if key == "entries":
+            for entry in value:
+                yield key, entry
+        else:
+            yield key, value
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 16])
+def test_stream_library_across_chunk_boundaries(
+    tagstudio_file, library_document, chunk_size
+):
+    with open(tagstudio_file, encoding="utf-8") as file:
+        items = list(stream_library(file, chunk_size))
+
+    assert items == list(expected_items(library_document))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1 << 16])
+@pytest.mark.parametrize(
+    "text",
+    [
+        "{}",
+        '{"entries": []}',
+        '{"entries":[{"id":1}],"ts-version":12345}',
+        '{ "tags" : [ ] , "entries" : [ {"id": 1.5e3} , {"id": -0} ] }',
+    ],
+)
+def test_stream_library_edge_cases(text, chunk_size):
+    items = list(stream_library(io.StringIO(text), chunk_size))
+
+    assert items == list(expected_items(json.loads(text)))
+
+
+@pytest.mark.parametrize("text", ['{"entries": [{"id": 1}', '{"tags": [', "[]"])
+def test_stream_library_rejects_broken_documents(text):
+    with pytest.raises(ValueError):
+        list(stream_library(io.StringIO(text), 2))
+
+
+def assert_same_store(store, other):
+    for name in SNAPSHOT_COLUMNS:
+        assert getattr(store, name).tolist() == getattr(other, name).tolist(), name
+
+    assert store.filenames == other.filenames
+    assert store.paths == other.paths
+    assert store.row_by_id == other.row_by_id
+    assert store.removed_rows == other.removed_rows
+    assert store.masks == other.masks
+    for tag_id in store.tag_index.tags_by_id:
+        assert store.tag_index.closure(tag_id) == other.tag_index.closure(tag_id)
+
+
+def test_snapshot_round_trip(tagstudio_file):
+    library = Library.load(tagstudio_file)
+    assert os.path.exists(snapshot_path(tagstudio_file))
+
+    restored = Library.read_snapshot(tagstudio_file)
+
+    assert restored is not None
+    assert restored.tags == library.tags
+    assert restored.fields == library.fields
+    assert restored.source_key == library.source_key
+    assert_same_store(restored.store, library.store)
+    assert_same_store(restored.store, Library.parse(tagstudio_file).store)
+
+
+def test_stale_snapshot_is_rebuilt(write_library, library_document):
+    tagstudio_file = write_library(library_document)
+    Library.load(tagstudio_file)
+
+    library_document["entries"].pop()
+    write_library(library_document)
+
+    assert Library.read_snapshot(tagstudio_file) is None
+    library = Library.load(tagstudio_file)
+    assert 8 not in library.store.row_by_id
+
+    # The rebuilt snapshot is for the new version
+    restored = Library.read_snapshot(tagstudio_file)
+    assert restored is not None
+    assert_same_store(restored.store, library.store)
+
+
+def test_truncated_snapshot_is_rebuilt(tagstudio_file):
+    library = Library.load(tagstudio_file)
+    path = snapshot_path(tagstudio_file)
+    with open(path, "rb") as file:
+        data = file.read()
+
+    for size in (4, len(SNAPSHOT_MAGIC) + 4, len(data) // 2, len(data) - 1):
+        with open(path, "wb") as file:
+            file.write(data[:size])
+
+        assert Library.read_snapshot(tagstudio_file) is None
+
+    assert_same_store(Library.load(tagstudio_file).store, library.store)
+
+
+def edit_library(document):
+    """Remove, add and change an entry, and change what a tag implies."""
+    entries = {entry["id"]: entry for entry in document["entries"]}
+    del entries[5]
+    entries[9] = {
+        "id": 9,
+        "filename": "new.mp3",
+        "path": "music",
+        "fields": [{"7": [2002]}],
+    }
+    entries[1]["fields"] = [{"7": [2004]}]
+    document["entries"] = list(entries.values())
+
+    # Lo-fi stops implying music, which changes entry 6 without touching it
+    document["tags"][0]["subtag_ids"] = []
+
+
+def entries_by_id(library):
+    return {
+        entry.id: (
+            entry.filename,
+            entry.path,
+            entry.content_tags,
+            entry.meta_tags,
+            entry.flags,
+        )
+        for entry in library.store
+    }
+
+
+def test_hot_reload_matches_a_fresh_parse(write_library, library_document):
+    tagstudio_file = write_library(library_document)
+    library = Library.load(tagstudio_file)
+
+    edit_library(library_document)
+    write_library(library_document)
+    diff = library.apply_update(library.read_update(tagstudio_file))
+
+    assert diff.added == [9]
+    assert diff.removed == [5]
+    assert diff.changed == [1]
+    assert diff.tags_changed
+
+    fresh = Library.parse(tagstudio_file)
+    assert entries_by_id(library) == entries_by_id(fresh)
+    for flag in EntryFlag:
+        assert ids_with(library, flag) == ids_with(fresh, flag), flag
+
+    assert library.tags == fresh.tags
+    assert library.source_key == fresh.source_key
+    assert library.read_update(tagstudio_file) is None
+
+
+def test_removing_a_library_tag_restores_the_base_tag(write_library, library_document):
+    library_document["tags"].append(
+        {"id": TagId.MEME, "name": "Meme", "subtag_ids": [TagId.MUSIC]}
+    )
+    library_document["entries"][0]["fields"] = [{"7": [TagId.MEME]}]
+    tagstudio_file = write_library(library_document)
+    library = Library.load(tagstudio_file)
+    assert 1 in ids_with(library, EntryFlag.HAS_MUSIC)
+
+    library_document["tags"].pop()
+    write_library(library_document)
+    diff = library.apply_update(library.read_update(tagstudio_file))
+
+    assert diff.tags_changed
+    assert diff.changed == []
+    assert 1 not in ids_with(library, EntryFlag.HAS_MUSIC)
+    assert entries_by_id(library) == entries_by_id(Library.parse(tagstudio_file))
+
+
+def test_rewriting_the_same_library_is_an_empty_diff(write_library, library_document):
+    tagstudio_file = write_library(library_document)
+    library = Library.load(tagstudio_file)
+    rows = len(library.store.ids)
+
+    write_library(library_document)
+    diff = library.apply_update(library.read_update(tagstudio_file))
+
+    assert diff.is_empty
+    assert len(library.store.ids) == rows
+
+
+def test_snapshot_after_a_reload(write_library, library_document):
+    tagstudio_file = write_library(library_document)
+    library = Library.load(tagstudio_file)
+
+    edit_library(library_document)
+    write_library(library_document)
+    library.apply_update(library.read_update(tagstudio_file))
+    library.write_snapshot(tagstudio_file)
+
+    restored = Library.read_snapshot(tagstudio_file)
+
+    # Removed rows are kept as removed, so the rows match the patched store
+    assert restored is not None
+    assert_same_store(restored.store, library.store)
+    assert entries_by_id(restored) == entries_by_id(Library.parse(tagstudio_file))
+
+
+def test_hot_reload_patches_the_dj_pools(tmp_path, write_library, library_document):
+    tagstudio_file = write_library(library_document)
+    dj = AutoMediaDJ(
+        vlc=InProcessVLC(),
+        vlc_audio=InProcessVLC(),
+        base_path=str(tmp_path),
+        persist_history=False,
+    )
+    # Build the pools before the reload, so they have to be patched
+    dj.video_sampler, dj.audio_sampler
+
+    edit_library(library_document)
+    write_library(library_document)
+    diff = dj.reload_library()
+    assert not diff.is_empty
+
+    fresh = AutoMediaDJ(
+        vlc=InProcessVLC(),
+        vlc_audio=InProcessVLC(),
+        base_path=str(tmp_path),
+        use_library_snapshot=False,
+        persist_history=False,
+    )
+    for pool in ("visual_choices", "music_choices", "audiovisual_choices"):
+        assert {entry.id for entry in getattr(dj, pool)} == {
+            entry.id for entry in getattr(fresh, pool)
+        }, pool
+
+    # Entries that left a pool are never drawn from it again
+    visual_ids = {entry.id for entry in fresh.visual_choices}
+    music_ids = {entry.id for entry in fresh.music_choices}
+    for _ in range(200):
+        assert dj.weighted_video_choice().id in visual_ids
+        assert dj.weighted_audio_choice().id in music_ids
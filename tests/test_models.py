@@ -0,0 +1,40 @@
+from models import VlcPlayerDataSnapshot
+
+
+def status(current_id, filename=None):
+    data = {"state": "playing", "currentplid": current_id}
+    if filename is not None:
+        data["information"] = {"category": {"meta": {"filename": filename}}}
+
+    return data
+
+
+def test_snapshot_reads_metadata_that_arrives_after_the_first_poll():
+    # VLC can report the new item before its metadata while switching tracks
+    first = VlcPlayerDataSnapshot(status(4))
+    second = VlcPlayerDataSnapshot(status(4, "b.mp4"), previous=first)
+
+    assert first.filename is None
+    assert second.filename == "b.mp4"
+
+
+def test_snapshot_rereads_metadata_for_the_same_item():
+    first = VlcPlayerDataSnapshot(status(4, "a.mp4"))
+    second = VlcPlayerDataSnapshot(status(4, "b.mp4"), previous=first)
+
+    assert second.filename == "b.mp4"
+
+
+def test_snapshot_keeps_metadata_when_a_status_leaves_it_out():
+    first = VlcPlayerDataSnapshot(status(4, "a.mp4"))
+    same_item = VlcPlayerDataSnapshot(status(4), previous=first)
+    other_item = VlcPlayerDataSnapshot(status(5), previous=same_item)
+
+    assert same_item.filename == "a.mp4"
+    assert other_item.filename is None
+
+
+def test_snapshot_decodes_latin1_filenames():
+    snapshot = VlcPlayerDataSnapshot(status(1, "cafÃ©.mp3"))
+
+    assert snapshot.filename == "café.mp3"
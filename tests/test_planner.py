@@ -0,0 +1,97 @@
+import itertools
+import os
+import time
+from bench import generate_library
+from constants import PlaybackMode
+from dj import AutoMediaDJ, reload_shared_library
+from fake_vlc import InProcessVLC
+from planner import LookaheadPlanner
+
+
+class Info:
+    def __init__(self, entry_id):
+        self.entry = self
+        self.id = entry_id
+
+
+def counting_chooser():
+    ids = itertools.count()
+    return lambda planned_ids: Info(next(ids))
+
+
+def wait_until_planned(planner, count):
+    for _ in range(200):
+        if all(planner.planned(mode) == count for mode in planner.choosers):
+            return
+
+        time.sleep(0.01)
+
+    raise AssertionError("The planner never filled up")
+
+
+def test_planner_takes_each_mode_on_its_own():
+    planner = LookaheadPlanner(
+        {
+            PlaybackMode.VIDEO: counting_chooser(),
+            PlaybackMode.AUDIO: counting_chooser(),
+        },
+        lookahead=4,
+    )
+    planner.start()
+    try:
+        wait_until_planned(planner, 4)
+        videos = planner.take(PlaybackMode.VIDEO, 2)
+
+        # Nothing planned for audio was thrown away to take the videos
+        assert [video.id for video in videos] == [0, 1]
+        assert [audio.id for audio in planner.take(PlaybackMode.AUDIO, 4)] == [
+            0,
+            1,
+            2,
+            3,
+        ]
+
+        wait_until_planned(planner, 4)
+        assert [video.id for video in planner.take(PlaybackMode.VIDEO, 4)] == [
+            2,
+            3,
+            4,
+            5,
+        ]
+    finally:
+        planner.stop()
+
+
+def test_planner_waits_for_a_reload_to_finish(tmp_path):
+    base_path = str(tmp_path)
+    generate_library(base_path, 300)
+    dj = AutoMediaDJ(
+        vlc=InProcessVLC(),
+        vlc_audio=InProcessVLC(),
+        base_path=base_path,
+        use_library_snapshot=False,
+        persist_history=False,
+        lookahead=4,
+    )
+    dj.think()
+    wait_until_planned(dj.planner, 4)
+
+    try:
+        # While a reload holds the lock, nothing more is planned
+        with dj.library.lock:
+            dj.planner.take(PlaybackMode.VIDEO, 4)
+            time.sleep(0.1)
+            assert dj.planner.planned(PlaybackMode.VIDEO) == 0
+
+            # A different library, with a third of the entries gone
+            generate_library(base_path, 200, seed=1)
+            os.utime(dj.tagstudio_file, (0, 0))
+            reload_shared_library(dj.library, dj.tagstudio_file, [dj], False)
+
+        wait_until_planned(dj.planner, 4)
+    finally:
+        dj.planner.stop()
+
+    live_ids = {entry.id for entry in dj.visual_choices}
+    for video in dj.planner.take(PlaybackMode.VIDEO, 4):
+        assert video.entry.id in live_ids
@@ -0,0 +1,43 @@
+import threading
+import time
+from prefetch import MediaPrefetcher
+
+
+class BlockedPrefetcher(MediaPrefetcher):
+    """Doesn't read anything until `release` is set, so the queue fills up."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.prefetched = []
+
+    def _prefetch_file(self, path):
+        self.release.wait()
+        self.prefetched.append(path)
+
+
+def wait_until(condition):
+    for _ in range(200):
+        if condition():
+            return
+
+        time.sleep(0.01)
+
+    raise AssertionError("Timed out")
+
+
+def test_file_skipped_on_a_full_queue_is_prefetched_later():
+    prefetcher = BlockedPrefetcher(max_pending=1)
+    prefetcher.prefetch("first")
+    wait_until(prefetcher._pending.empty)
+
+    # The worker is stuck on "first" and "second" fills the queue
+    prefetcher.prefetch("second")
+    prefetcher.prefetch("third")
+
+    prefetcher.release.set()
+    wait_until(lambda: len(prefetcher.prefetched) == 2)
+    prefetcher.prefetch("third")
+    wait_until(lambda: len(prefetcher.prefetched) == 3)
+
+    assert prefetcher.prefetched == ["first", "second", "third"]
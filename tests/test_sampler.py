@@ -0,0 +1,25 @@
+import random
+import pytest
+from sampler import WeightedSampler
+
+
+def test_sample_where_follows_small_weights():
+    # Every key is rarely accepted, so most draws go past max_attempts
+    acceptance = {key: 0.001 * (key + 1) for key in range(10)}
+    sampler = WeightedSampler(range(10))
+    rng = random.Random(1)
+
+    draws = 20000
+    counts = [0] * 10
+    for _ in range(draws):
+        counts[sampler.sample_where(acceptance.get, rng)] += 1
+
+    total = sum(acceptance.values())
+    for key in range(10):
+        assert counts[key] / draws == pytest.approx(acceptance[key] / total, abs=0.015)
+
+
+def test_sample_where_raises_when_everything_is_rejected():
+    sampler = WeightedSampler(range(5))
+    with pytest.raises(IndexError):
+        sampler.sample_where(lambda key: 0.0, random.Random(1))
@@ -0,0 +1,87 @@
+from constants import TagId
+from tags import TagIndex, base_tag_index
+
+
+def tag(tag_id, *subtag_ids):
+    return {"id": tag_id, "name": f"Tag {tag_id}", "subtag_ids": list(subtag_ids)}
+
+
+def implied(tag_index, tag_id):
+    return {
+        other_id
+        for other_id in tag_index.tags_by_id
+        if tag_index.has_tag(tag_index.closure(tag_id), other_id)
+    }
+
+
+def test_closure_follows_subtags_transitively():
+    tag_index = TagIndex([tag(1, 2), tag(2, 3), tag(3), tag(4, 1, 3)])
+
+    assert implied(tag_index, 1) == {1, 2, 3}
+    assert implied(tag_index, 3) == {3}
+    assert implied(tag_index, 4) == {1, 2, 3, 4}
+    assert tag_index.search(3, [1])
+    assert not tag_index.search(1, [3])
+
+
+def test_cycles_terminate():
+    tag_index = TagIndex([tag(1, 2), tag(2, 1)])
+
+    assert implied(tag_index, 1) == implied(tag_index, 2) == {1, 2}
+
+
+def test_updating_a_tag_invalidates_the_closures_through_it():
+    tag_index = TagIndex([tag(1, 2), tag(2, 3), tag(3), tag(4), tag(5, 4)])
+    unaffected = tag_index.closure(5)
+
+    tag_index.update_tags([tag(2, 4)])
+
+    assert implied(tag_index, 1) == {1, 2, 4}
+    assert not tag_index.search(3, [1])
+    assert tag_index.closure(5) == unaffected
+
+
+def test_adding_a_tag_links_the_closures_that_already_named_it():
+    # 1 names 2 as a subtag before 2 is known
+    tag_index = TagIndex([tag(1, 2)])
+    assert tag_index.search(2, [1])
+    assert not tag_index.search(3, [1])
+
+    tag_index.update_tags([tag(2, 3), tag(3)])
+
+    assert implied(tag_index, 1) == {1, 2, 3}
+
+
+def test_removing_a_tag_cuts_the_closures_through_it():
+    tag_index = TagIndex([tag(1, 2), tag(2, 3), tag(3)])
+
+    tag_index.remove_tags([2])
+
+    # 1 still names 2, but 2 no longer leads anywhere
+    assert tag_index.search(2, [1])
+    assert not tag_index.search(3, [1])
+    assert 2 not in tag_index.tags_by_id
+
+
+def test_unknown_tags_only_match_themselves():
+    tag_index = TagIndex([tag(1, 2), tag(2)])
+
+    assert tag_index.search(99, [99])
+    assert not tag_index.search(99, [1])
+    assert not tag_index.search(1, [99])
+
+
+def test_snapshot_round_trip_keeps_the_closures():
+    tag_index = TagIndex([tag(1, 2), tag(2, 3), tag(3)])
+    restored = TagIndex.from_snapshot(tag_index.to_snapshot())
+
+    assert implied(restored, 1) == {1, 2, 3}
+
+    # And it keeps invalidating correctly afterwards
+    restored.update_tags([tag(2)])
+    assert implied(restored, 1) == {1, 2}
+
+
+def test_base_tags_are_indexed():
+    assert base_tag_index.search(TagId.ARCHIVED, [TagId.ARCHIVED])
+    assert not base_tag_index.search(TagId.ARCHIVED, [TagId.MUSIC])
@@ -0,0 +1,54 @@
+import os
+import pytest
+import python_vlc_http
+from fake_vlc import InProcessVLC
+
+
+class RefusingVLC(InProcessVLC):
+    def send_request(self, resource, param=""):
+        if param.startswith("command=in_enqueue"):
+            raise python_vlc_http.RequestFailed("Simulated failure")
+
+        return super().send_request(resource, param)
+
+
+def playlists(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".m3u"))
+
+
+def test_each_batch_gets_its_own_playlist_file(tmp_path):
+    vlc = InProcessVLC(playlist_dir=str(tmp_path))
+    for batch in range(6):
+        vlc.enqueue_many([f"file:///media/{batch}_{i}.mp4" for i in range(2)])
+
+    # None of them was rewritten, in case VLC hasn't read it yet
+    files = playlists(tmp_path)
+    assert len(files) == 6
+    for name in files:
+        with open(tmp_path / name, encoding="utf-8") as file:
+            assert len(file.read().splitlines()) == 3
+
+    assert len(vlc.simulator.playlist) == 12
+
+
+def test_old_playlist_files_are_removed(tmp_path):
+    vlc = InProcessVLC(playlist_dir=str(tmp_path), playlist_lifetime=60)
+    vlc.enqueue_many(["file:///media/a.mp4", "file:///media/b.mp4"])
+    (old,) = playlists(tmp_path)
+    os.utime(tmp_path / old, (0, 0))
+    (tmp_path / "unrelated.m3u").write_text("#EXTM3U\n")
+
+    vlc.enqueue_many(["file:///media/c.mp4", "file:///media/d.mp4"])
+
+    files = playlists(tmp_path)
+    assert old not in files
+    assert "unrelated.m3u" in files
+    assert len(files) == 2
+
+
+def test_failed_batch_removes_its_playlist_file(tmp_path):
+    vlc = RefusingVLC(playlist_dir=str(tmp_path))
+    with pytest.raises(python_vlc_http.RequestFailed):
+        vlc.enqueue_many(["file:///media/a.mp4", "file:///media/b.mp4"])
+
+    assert playlists(tmp_path) == []
@@ -0,0 +1,135 @@
+import asyncio
+import python_vlc_http
+from bench import generate_library
+from fake_vlc import InProcessVLC, SimulatedVLC
+from zones import MultiZoneDJ
+
+
+class UnreachableVLC(InProcessVLC):
+    """Answers while the DJ is being set up, then fails every request."""
+
+    def __init__(self, **kwargs):
+        self.reachable = True
+        self.refused = 0
+        super().__init__(**kwargs)
+
+    def send_request(self, resource, param=""):
+        if not self.reachable:
+            self.refused += 1
+            raise python_vlc_http.RequestFailed("The VLC Server is unreachable")
+
+        return super().send_request(resource, param)
+
+
+def test_failing_zone_does_not_stop_the_others(tmp_path):
+    base_path = str(tmp_path)
+    generate_library(base_path, 200)
+
+    multi_dj = MultiZoneDJ(base_path, use_library_snapshot=False)
+    broken = UnreachableVLC()
+    multi_dj.add_zone("broken", broken, UnreachableVLC(), persist_history=False)
+
+    working = SimulatedVLC()
+    working_audio = SimulatedVLC()
+    zone = multi_dj.add_zone(
+        "working",
+        InProcessVLC(working),
+        InProcessVLC(working_audio),
+        persist_history=False,
+    )
+    broken.reachable = False
+
+    async def run():
+        try:
+            await asyncio.wait_for(multi_dj.start(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+    commands_before = working.commands
+    asyncio.run(run())
+
+    # Still running until the timeout, and the working zone kept ticking
+    assert len(zone.video_queue) == zone.queue_depth
+    assert working.commands - commands_before > 5
+    assert multi_dj.zones["broken"].video_queue == []
+
+
+class RecordingMultiZoneDJ(MultiZoneDJ):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+
+    def zone_failed(self, name, error):
+        self.events.append(("failed", name))
+
+    def zone_recovered(self, name):
+        self.events.append(("recovered", name))
+
+
+def test_failing_zone_backs_off_and_recovers(tmp_path):
+    base_path = str(tmp_path)
+    generate_library(base_path, 200)
+
+    multi_dj = RecordingMultiZoneDJ(base_path, use_library_snapshot=False)
+    vlc = UnreachableVLC()
+    vlc_audio = UnreachableVLC()
+    zone = multi_dj.add_zone(
+        "flaky", vlc, vlc_audio, persist_history=False, max_tick_interval=0.4
+    )
+    vlc.reachable = vlc_audio.reachable = False
+
+    async def run():
+        task = asyncio.ensure_future(multi_dj.start())
+        await asyncio.sleep(1.0)
+        failed_ticks = zone.failed_ticks
+        vlc.reachable = vlc_audio.reachable = True
+        await asyncio.sleep(1.0)
+        task.cancel()
+        return failed_ticks
+
+    failed_ticks = asyncio.run(run())
+
+    # Waits of 0.2, 0.4, 0.4... instead of a retry every min_tick_interval
+    assert 2 <= failed_ticks <= 4
+    assert vlc.refused <= failed_ticks
+    assert multi_dj.events == [("failed", "flaky"), ("recovered", "flaky")]
+    assert zone.failed_ticks == 0
+    assert len(zone.video_queue) == zone.queue_depth
+
+
+def test_watch_reloads_the_shared_library(tmp_path):
+    base_path = str(tmp_path)
+    generate_library(base_path, 200)
+
+    multi_dj = MultiZoneDJ(
+        base_path,
+        use_library_snapshot=False,
+        watch_library=True,
+        library_check_interval=0.1,
+    )
+    zones = [
+        multi_dj.add_zone(
+            name,
+            InProcessVLC(SimulatedVLC()),
+            InProcessVLC(SimulatedVLC()),
+            persist_history=False,
+        )
+        for name in ("a", "b")
+    ]
+
+    async def run():
+        task = asyncio.ensure_future(multi_dj.start())
+        await asyncio.sleep(0.3)
+        # Same seed, so the first 200 entries stay as they were
+        generate_library(base_path, 300)
+        await asyncio.sleep(1.0)
+        task.cancel()
+
+    asyncio.run(run())
+
+    assert len(multi_dj.library.store) == 300
+    for zone in zones:
+        assert len(zone.entry_store) == 300
+        # New entries are drawn from, not only stored
+        assert any(entry.id >= 200 for entry in zone.visual_choices)
+        assert all(entry.id in zone.video_sampler for entry in zone.visual_choices)
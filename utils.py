@@ -1,9 +1,8 @@
 import logging
-from typing import Dict, List, Optional
-from constants import ALL_TAGS_BY_ID
+from typing import Dict, Iterable, List, Optional
 import urllib.parse
 import urllib
-import cachetools
+from tags import base_tag_index
 
 
 def get_logger(name: str):
@@ -79,65 +78,31 @@ def mrl_from_path(
     return mrl
 
 
-tag_search_cache = cachetools.LRUCache(maxsize=1024)
+def search_for_tag(tag_id: int, root_tags: List[int]) -> bool:
+    # Checks the root tags and everything they imply through subtags
+    return base_tag_index.search(tag_id, root_tags)
 
 
-# Breadth-first search
-def search_for_tag(tag_id: int, root_tags: List[int]) -> bool:
-    tag_queue_history = set(root_tags)
-
-    if tag_id in tag_queue_history:
-        # Return early if the tag blatantly is sitting at the root
-        # All logic after this point is to handle subtags
-        return True
-
-    root_tags_uncached = list()
-    for root_tag_id in root_tags:
-        tag_cache_key = f"{tag_id}-{root_tag_id}"
-
-        # Save the root tags that haven't been cached yet
-        if tag_cache_key not in tag_search_cache:
-            root_tags_uncached.append(root_tag_id)
-            continue
-
-        if tag_search_cache[tag_cache_key]:
-            # If it has been checked and found to have the tag, return early
-            return True
-
-    # Only queue up the root tags that haven't already been cached
-    # By this point, we know that none of the cached entries are hits
-    tag_queue = root_tags_uncached.copy()
-
-    while tag_queue:
-        curr_tag_id = tag_queue.pop(0)
-        tag_cache_key = f"{tag_id}-{curr_tag_id}"
-
-        # Check if this tag has already been checked
-        if tag_cache_key in tag_search_cache:
-            # If it has been checked and found to have the tag, return True
-            if tag_search_cache[tag_cache_key]:
-                return True
-
-            # If it has been checked and found to not have the tag, skip it
-            continue
-
-        if curr_tag_id == tag_id or tag_id in tag_queue_history:
-            # Cache the result for the root tag, but only if there was only one root tag that was uncached
-            if len(root_tags_uncached) == 1:
-                tag_search_cache[f"{tag_id}-{root_tags_uncached[0]}"] = True
-
-            return True
-
-        tag_data = ALL_TAGS_BY_ID[curr_tag_id]
-        subtags = tag_data.get("subtag_ids", [])
-        subtags_not_already_queued = (
-            subtag_id for subtag_id in subtags if subtag_id not in tag_queue_history
-        )
-        tag_queue.extend(subtags_not_already_queued)
-        tag_queue_history.update(subtags)
-
-    # tag_id wasn't found in any of the tags that were queued, so cache that info for all of them
-    for missed_tag_id in tag_queue_history:
-        tag_search_cache[f"{tag_id}-{missed_tag_id}"] = False
-
-    return False
+# Positions of the set bits in every possible byte
+BYTE_BIT_POSITIONS = [
+    tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)
+]
+
+
+def bitset_from_indices(indices: Iterable[int], size: int) -> int:
+    data = bytearray((size + 7) // 8)
+    for index in indices:
+        data[index >> 3] |= 1 << (index & 7)
+
+    return int.from_bytes(data, "little")
+
+
+def indices_from_bitset(bitset: int) -> List[int]:
+    indices = []
+    data = bitset.to_bytes((bitset.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index * 8
+            indices.extend(base + bit for bit in BYTE_BIT_POSITIONS[byte])
+
+    return indices
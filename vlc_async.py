@@ -0,0 +1,49 @@
+import asyncio
+from typing import Any, List, Optional
+
+from models import VlcPlayerDataSnapshot
+from vlc_ext import HttpVLCExt
+
+
+class AsyncHttpVLC:
+    """
+    asyncio front end for an HttpVLCExt.
+
+    Each call runs the blocking HTTP request in a worker thread, so requests to
+    different players can be in flight at the same time. Requests to the same
+    player are still sent one at a time, in order.
+    """
+
+    def __init__(self, vlc: HttpVLCExt):
+        self.vlc = vlc
+        self._lock = asyncio.Lock()
+
+    async def _call(self, func, *args, **kwargs) -> Any:
+        async with self._lock:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    @property
+    def enabled(self) -> bool:
+        return self.vlc.enabled
+
+    @property
+    def recent_data(self) -> Optional[VlcPlayerDataSnapshot]:
+        return self.vlc.recent_data
+
+    async def enqueue(self, mrl: str):
+        return await self._call(self.vlc.enqueue, mrl)
+
+    async def enqueue_many(self, mrls: List[str]):
+        return await self._call(self.vlc.enqueue_many, mrls)
+
+    async def play(self, muted: Optional[bool] = None):
+        return await self._call(self.vlc.play, muted=muted)
+
+    async def pause(self, force: bool = False):
+        return await self._call(self.vlc.pause, force=force)
+
+    async def set_volume(self, volume: float):
+        return await self._call(self.vlc.set_volume, volume)
+
+    async def fetch_data_snapshot(self, command=None) -> VlcPlayerDataSnapshot:
+        return await self._call(self.vlc.fetch_data_snapshot, command)
@@ -1,51 +1,230 @@
+import os
+import re
+import tempfile
 import time
-from typing import Optional
+from typing import Dict, List, Optional
 from python_vlc_http import HttpVLC
 import urllib.parse
 import urllib
 import python_vlc_http
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from metrics import VLC_REQUEST_FAILURES, VLC_REQUEST_SECONDS
 from models import VlcPlayerDataSnapshot
+from utils import mrl_from_path, windows_path_to_wsl
+
+
+def request_command(resource: str, param: str) -> str:
+    """The VLC command a request sends, or the resource it reads."""
+    if param.startswith("command="):
+        return param[len("command=") :].split("&", 1)[0]
+
+    return resource
 
 
 class HttpVLCExt(HttpVLC):
-    def __init__(self, host=None, username=None, password=None):
+    def __init__(
+        self,
+        host=None,
+        username=None,
+        password=None,
+        playlist_dir: Optional[str] = None,
+        playlist_lifetime: float = 24 * 60 * 60,
+        connect_timeout: float = 2.0,
+        read_timeout: float = 5.0,
+        retries: int = 2,
+        backoff_factor: float = 0.1,
+        reuse_metadata: bool = True,
+    ):
         # super().__init__(host=host, username=username, password=password)
         self.host = host
         self.username = username or ""
         self.password = password or ""
         self.enabled = False
+        self.timeout = (connect_timeout, read_timeout)
+        # A directory both this process and VLC can read, as VLC sees it
+        self.playlist_dir = playlist_dir
+        # VLC reads a queued playlist file whenever it gets to it, so the files
+        # are only removed once they're this many seconds old
+        self.playlist_lifetime = playlist_lifetime
+        # Only extract the information tree when the playlist item changes
+        self.reuse_metadata = reuse_metadata
+        self._snapshot: Optional[VlcPlayerDataSnapshot] = None
+        self._previous_snapshot: Optional[VlcPlayerDataSnapshot] = None
 
         if self.host is None or self.host == "":
             raise python_vlc_http.MissingHost("Host is empty! Input host to proceed")
 
+        # Keep-alive sessions per player, so requests reuse the same connection.
+        # Polls are safe to send again, but commands like in_enqueue aren't, so
+        # commands are only retried when the connection couldn't be made at all
+        self.session = self.make_session(
+            Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET"],
+            )
+        )
+        self.command_session = self.make_session(
+            Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                status=0,
+                other=0,
+                backoff_factor=backoff_factor,
+                allowed_methods=["GET"],
+            )
+        )
+
         self.fetch_data()
 
+    def make_session(self, retry: Retry) -> requests.Session:
+        session = requests.Session()
+        session.auth = (self.username, self.password)
+        session.mount("http://", HTTPAdapter(max_retries=retry, pool_maxsize=1))
+        session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=1))
+        return session
+
+    def fetch_api(self, resource, param=""):
+        # Every request to VLC goes through here, so they're all timed
+        command = request_command(resource, param)
+        start = time.perf_counter()
+        try:
+            return self.send_request(resource, param)
+        except Exception:
+            VLC_REQUEST_FAILURES.inc(player=self.host, command=command)
+            raise
+        finally:
+            VLC_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, player=self.host, command=command
+            )
+
+    def send_request(self, resource, param=""):
+        # Same as HttpVLC.fetch_api, but through the pooled session
+        try:
+            url = f"{self.host}/requests/{resource}.json?{param}"
+            is_command = param.startswith("command=")
+            session = self.command_session if is_command else self.session
+            response = session.get(url, timeout=self.timeout)
+            self.status_code(response)
+            return response.json()
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.RetryError,
+        ) as error:
+            raise python_vlc_http.RequestFailed(
+                f"The VLC Server is unreachable. Error code: {error}"
+            )
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Requests sent and connections opened, to check that connections are reused."""
+        stats = {"requests": 0, "connections": 0}
+        for session in (self.session, self.command_session):
+            for adapter in session.adapters.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    stats["requests"] += pool.num_requests
+                    stats["connections"] += pool.num_connections
+
+        stats["reused"] = stats["requests"] - stats["connections"]
+        return stats
+
     def enqueue(self, mrl: str):
         mrl = urllib.parse.quote(mrl)
         return self.parse_data(command=f"in_enqueue&input={mrl}")
 
+    def enqueue_many(self, mrls: List[str]):
+        # One request through an M3U playlist that VLC expands, if it can read one
+        if self.playlist_dir is None or len(mrls) < 2:
+            for mrl in mrls:
+                self.enqueue(mrl)
+            return
+
+        self.remove_old_playlists()
+
+        # A new file per batch, so none is rewritten before VLC has read it
+        fd, local_file = tempfile.mkstemp(
+            dir=windows_path_to_wsl(self.playlist_dir),
+            prefix=self.playlist_prefix,
+            suffix=".m3u",
+        )
+        playlist_file = os.path.join(self.playlist_dir, os.path.basename(local_file))
+
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write("#EXTM3U\n")
+                file.writelines(f"{mrl}\n" for mrl in mrls)
+
+            return self.enqueue(mrl_from_path(playlist_file))
+        except Exception:
+            # The DJ won't track these items, so VLC mustn't play them even if
+            # the request did get through
+            os.remove(local_file)
+            raise
+
+    @property
+    def playlist_prefix(self) -> str:
+        host_name = re.sub(r"\W+", "_", self.host).strip("_")
+        return f"dj_queue_{host_name}_"
+
+    def remove_old_playlists(self):
+        """Remove batch playlists past their lifetime, from this run or earlier ones."""
+        local_dir = windows_path_to_wsl(self.playlist_dir)
+        expired_before = time.time() - self.playlist_lifetime
+        try:
+            names = os.listdir(local_dir)
+        except OSError:
+            return
+
+        for name in names:
+            if name.startswith(self.playlist_prefix) and name.endswith(".m3u"):
+                path = os.path.join(local_dir, name)
+                try:
+                    if os.path.getmtime(path) < expired_before:
+                        os.remove(path)
+                except OSError:
+                    # Already gone, e.g. removed by another zone sharing the directory
+                    pass
+
     def enqueue_and_play(self, mrl: str):
         mrl = urllib.parse.quote(mrl)
         return self.parse_data(command=f"in_play&input={mrl}")
 
     def fetch_data(self, command=None):
         self._data = self.fetch_status(command)
+
+        # Keep the last snapshot around so its metadata can be reused
+        if self.reuse_metadata and self._snapshot is not None:
+            self._previous_snapshot = self._snapshot
+
+        self._snapshot = None
         return self._data
 
     def fetch_data_snapshot(self, command=None) -> VlcPlayerDataSnapshot:
-        return VlcPlayerDataSnapshot(
-            data=self.fetch_data(command),
-        )
+        self.fetch_data(command)
+        return self.recent_data_snapshot()
+
+    def recent_data_snapshot(self) -> VlcPlayerDataSnapshot:
+        # Built at most once per response, however often it's read
+        if self._snapshot is None:
+            self._snapshot = VlcPlayerDataSnapshot(
+                self._data, previous=self._previous_snapshot
+            )
+
+        return self._snapshot
 
     @property
     def recent_data(self) -> Optional[VlcPlayerDataSnapshot]:
         if not self.enabled:
             return None
 
-        return VlcPlayerDataSnapshot(
-            data=self._data,
-        )
+        return self.recent_data_snapshot()
 
     def set_volume(self, volume: float):
         """Set volume level, range 0.0-1.5."""
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from functools import cached_property, partial
+from typing import Dict, Optional
+from dj import AutoMediaDJ, reload_shared_library_async
+from library import Library, tagstudio_file_path
+from vlc_ext import HttpVLCExt
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+class MultiZoneDJ:
+    """
+    Runs one AutoMediaDJ per zone in a single process.
+
+    Every zone has its own players, mode, queues and history, but they all
+    share one loaded library, so adding a zone doesn't parse the library
+    again or hold another copy of it. The zones take turns on one event loop
+    using the async DJ loop.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        use_library_snapshot: bool = True,
+        index_workers: int = 0,
+        watch_library: bool = False,
+        library_check_interval: float = 5.0,
+    ):
+        self.base_path = base_path
+        self.use_library_snapshot = use_library_snapshot
+        self.index_workers = index_workers
+        self.watch_library = watch_library
+        self.library_check_interval = library_check_interval
+        self.zones: Dict[str, AutoMediaDJ] = {}
+
+    @property
+    def tagstudio_file(self) -> str:
+        return tagstudio_file_path(self.base_path)
+
+    @cached_property
+    def library(self) -> Library:
+        return Library.load(
+            self.tagstudio_file, self.use_library_snapshot, self.index_workers
+        )
+
+    def add_zone(
+        self,
+        name: str,
+        vlc: HttpVLCExt,
+        vlc_audio: Optional[HttpVLCExt] = None,
+        **kwargs,
+    ) -> AutoMediaDJ:
+        if name in self.zones:
+            raise ValueError(f"Zone {name} already exists")
+
+        # The library is watched once for every zone, in watch
+        zone = AutoMediaDJ(
+            vlc=vlc,
+            vlc_audio=vlc_audio,
+            base_path=self.base_path,
+            zone=name,
+            shared_library=self.library,
+            watch_library=False,
+            **kwargs,
+        )
+        self.zones[name] = zone
+        return zone
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.library_check_interval)
+            if self.zones:
+                await reload_shared_library_async(
+                    self.library,
+                    self.tagstudio_file,
+                    list(self.zones.values()),
+                    self.use_library_snapshot,
+                )
+
+    def zone_failed(self, name: str, error: Exception):
+        # One room's players going away shouldn't stop the others
+        logger.warning(f"Zone {name} failed, retrying with backoff: {error}")
+
+    def zone_recovered(self, name: str):
+        logger.info(f"Zone {name} recovered")
+
+    async def start(self):
+        if not self.zones:
+            raise ValueError("No zones to run")
+
+        logger.info(f"Starting {len(self.zones)} zones: {', '.join(self.zones)}")
+        started_at = time.monotonic()
+        library = self.library
+        logger.info(
+            f"Library loaded with {len(library.store)} entries "
+            f"in {time.monotonic() - started_at:.2f}s"
+        )
+
+        tasks = [
+            zone.start_async(
+                on_error=partial(self.zone_failed, name),
+                on_recovered=partial(self.zone_recovered, name),
+            )
+            for name, zone in self.zones.items()
+        ]
+        if self.watch_library:
+            tasks.append(self.watch())
+
+        await asyncio.gather(*tasks)